@@ -0,0 +1,130 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    asyncio scan engine for the client
+## Notes:
+##  - All probes run on a single event loop, which lives in its own thread.
+##    The main thread submits chunks to it with Engine.minion
+##  - The number of concurrent probes is capped by Engine.limit,
+##    or by the limit of an rtt.Controller if one is passed
+##  - Return values are the same as client.tryPort
+import asyncio,threading,os,time
+import data,globe,client,metrics,profiling
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+
+async def tryPort(id,addr,port,timeout,delay,tries=3):
+	'''Tries connecting to a port.
+	A refused connection is retried tries times, with delay seconds between each.
+	Returns an int:
+		0=ACCEPTED
+		1=CLOSED
+		2=DROPPED
+		3=SERVER ERROR (Bad reply)
+	'''
+	return (await probePort(id,addr,port,timeout,delay,tries))[0]
+
+async def probePort(id,addr,port,timeout,delay,tries=3,ctl=None):
+	'''Same as tryPort, but returns (result,latency,attempts) like client.probePort.
+	If ctl (an rtt.Controller) is passed, it picks the timeout and delay, and is fed the results'''
+	if ctl:
+		timeout=ctl.timeout()
+		delay=ctl.retryDelay()
+	res,latency,attempts=await _probePort(id,addr,port,timeout,delay,tries)
+	if ctl:
+		if latency!=None:
+			ctl.sample(latency)
+		ctl.record(res)
+	return (res,latency,attempts)
+
+async def _probePort(id,addr,port,timeout,delay,tries):
+	'''Does the actual probing for probePort'''
+	counter=tries
+	attempts=0
+	while counter>0:
+		attempts+=1
+		try:
+			start=time.monotonic()
+			reader,writer=await asyncio.wait_for(asyncio.open_connection(addr,port),timeout)
+			latency=time.monotonic()-start
+			break
+		except asyncio.TimeoutError:
+			return (2,None,attempts)
+		except (ConnectionRefusedError,ConnectionResetError):
+			if counter>1:  #No point waiting after the last try
+				await asyncio.sleep(delay)
+		except ConnectionAbortedError:  #Generic error, isn't an issue
+			continue  #Skip counter decrement
+		counter-=1
+	if counter==0:  #Not timeout, but couldn't connect
+		return (1,None,attempts)
+	if globe.ledger:  #Fast mode: connecting is enough, the server's ledger confirms it later
+		globe.ledger.probe(port,writer.get_extra_info("sockname"))
+		writer.close()
+		return (0,latency,attempts)
+	try:
+		#Send OK
+		writer.write(data.okFrame(id))
+		#Get OK
+		try:
+			recv_data=await asyncio.wait_for(reader.read(17),timeout)
+		except asyncio.TimeoutError:  #Server never replied, same as an empty Unit
+			return (3,latency,attempts)
+		except ConnectionResetError:  #Socket closed unexpectedly
+			return (3,latency,attempts)
+		if recv_data==b'':  #Socket closed by server, assume "port in use"
+			return (3,latency,attempts)
+		if data.isOk(recv_data,id):
+			return (0,latency,attempts)
+		return (3,latency,attempts)
+	finally:
+		writer.close()
+
+class Engine():
+	'''Runs an event loop in a background thread and probes submitted chunks on it'''
+	def __init__(self,limit=500,ctl=None):
+		self.limit=limit  #Max number of probes in flight
+		self.ctl=ctl  #rtt.Controller, if adaptive
+		self.inflight=0
+		self.cond=asyncio.Condition()
+		self.loop=asyncio.new_event_loop()
+		self.futures=[]  #One concurrent.futures.Future per submitted chunk
+		self.thread=threading.Thread(target=profiling.wrap(self.loop.run_forever),daemon=True)
+		self.thread.start()
+
+	async def _probe(self,id,addr,port,timeout,delay,tries):
+		'''Probe a single port once a slot is free, then store the result'''
+		async with self.cond:
+			while self.inflight>=(self.ctl.limit if self.ctl else self.limit):
+				await self.cond.wait()
+			self.inflight+=1
+		if globe.pacer:
+			await globe.pacer.wait(addr,port)
+		metrics.INFLIGHT.inc()
+		try:
+			res,latency,attempts=await probePort(id,addr,port,timeout,delay,tries,self.ctl)
+			globe.results.set(port,res,latency,attempts)
+		finally:
+			metrics.INFLIGHT.dec()
+			async with self.cond:
+				self.inflight-=1
+				#The controller may have raised the limit, so wake everyone that now fits
+				self.cond.notify(max(1,(self.ctl.limit if self.ctl else self.limit)-self.inflight))
+	async def _minion(self,addr,ports,timeout,delay,screen,tries):
+		'''Coroutine equivalent of client.minion_thread'''
+		my_id=os.urandom(16)
+		await asyncio.gather(*[self._probe(my_id,addr,p,timeout,delay,tries) for p in ports])
+		client.chunkDone(screen)
+
+	def minion(self,addr,ports,timeout,delay,screen,tries=3):
+		'''Schedule a chunk of ports on the loop.
+		Returns a concurrent.futures.Future'''
+		fut=asyncio.run_coroutine_threadsafe(self._minion(addr,ports,timeout,delay,screen,tries),self.loop)
+		self.futures.append(fut)
+		return fut
+	def join(self):
+		'''Wait for every submitted chunk, then stop the loop'''
+		for f in self.futures:
+			f.result()
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    End to end throughput and accuracy benchmark: full client/server scans over loopback
+## Notes:
+##  - Run from the repo root: python bench/scan_suite.py [quick|full] [results dir]
+##    Compare two saved runs: python bench/scan_suite.py compare old.json new.json
+##  - Every run starts its own server (and firewall) and client as separate processes, exactly like a user would,
+##    with the client --headless and writing a JSON report, which is checked against the ground truth
+##  - Scenarios:
+##      loopback: The client scans the server directly. Every port should be ACCEPTED
+##      firewall: The client scans firewall.py on FW_ADDR, which relays to the server. Every DROP_EVERYth port is dropped,
+##                every REJECT_EVERYth is rejected (CLOSED), and the rest are relayed (ACCEPTED)
+##  - Client resource use is sampled from /proc every SAMPLE seconds (threads, file descriptors).
+##    Peak RSS comes from the kernel (wait4), so it's exact
+##  - Results are saved as JSON, named after the git revision, so runs from two versions can be compared
+import sys,os,time,json,threading,subprocess,itertools,socket
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+import results
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+SRV_ADDR="127.0.0.1"
+FW_ADDR="127.0.0.2"
+DATA_PORT=9090
+BASE=20000
+DROP_EVERY=50
+REJECT_EVERY=20
+SAMPLE=0.02
+RUN_TIMEOUT=600  #Seconds before a run is killed and marked as timed out
+#Every combination is run. Without lock-step, a thread engine run can take minutes (see --delay)
+MATRICES={"quick":{"ports":[1000,10000],
+		"chunk":[500],
+		"timeout":[1],
+		"delay":[1],
+		"engine":["async"],
+		"lockstep":[True],
+		"scenario":["loopback","firewall"]},
+	"full":{"ports":[1000,10000,30000,64512],
+		"chunk":[100,500,2000],
+		"timeout":[1,3],
+		"delay":[0.6,1],
+		"engine":["thread","async"],
+		"lockstep":[False,True],
+		"scenario":["loopback","firewall"]}}
+
+def portRange(n):
+	'''Returns (start,end) for a scan of n ports, above the well-known ports'''
+	start=BASE if BASE+n<=results.PORTS else results.PORTS-n
+	return (start,start+n)
+def truth(scenario,port,start):
+	'''The result a port should get (see results.NAMES)'''
+	if scenario=="loopback":
+		return "accept"
+	i=port-start
+	if i%DROP_EVERY==DROP_EVERY//2:
+		return "drop"
+	if i%REJECT_EVERY==REJECT_EVERY//2:
+		return "close"
+	return "accept"
+def firewallRules(start,end):
+	'''Rules for firewall.py matching truth()'''
+	toret=[f"{DATA_PORT}:accept"]
+	for p in range(start,end):
+		res=truth("firewall",p,start)
+		if res!="accept":
+			toret.append(f"{p}:{'drop' if res=='drop' else 'reject'}")
+	toret.append(f"{start}-{end-1}:accept")  #First match wins, so this only catches the rest
+	return toret
+
+class Sampler():
+	'''Tracks the peak thread and file descriptor count of a process'''
+	def __init__(self,pid):
+		self.pid=pid
+		self.threads=0
+		self.fds=0
+		self.running=True
+		self.thread=threading.Thread(target=self._run,daemon=True)
+		self.thread.start()
+	def _run(self):
+		while self.running:
+			try:
+				with open(f"/proc/{self.pid}/status") as f:
+					for line in f:
+						if line.startswith("Threads:"):
+							self.threads=max(self.threads,int(line.split()[1]))
+							break
+				self.fds=max(self.fds,len(os.listdir(f"/proc/{self.pid}/fd")))
+			except (FileNotFoundError,ProcessLookupError,ValueError):
+				pass  #Exited, or a zombie
+			time.sleep(SAMPLE)
+	def stop(self):
+		self.running=False
+		self.thread.join()
+
+def waitFor(proc,text,timeout=30):
+	'''Reads proc's stdout until a line contains text'''
+	end=time.monotonic()+timeout
+	while time.monotonic()<end:
+		line=proc.stdout.readline()
+		if not line:
+			break
+		if text in line:
+			return True
+	raise RuntimeError(f"Never saw {text!r}")
+def stopProc(proc):
+	if proc and proc.poll()==None:
+		proc.terminate()
+		try:
+			proc.wait(5)
+		except subprocess.TimeoutExpired:
+			proc.kill()
+			proc.wait()
+
+def run(cfg,outfile):
+	'''Runs one scan. Returns its metrics (dict)'''
+	start,end=portRange(cfg["ports"])
+	ip=FW_ADDR if cfg["scenario"]=="firewall" else SRV_ADDR
+	srv=fw=None
+	if os.path.exists(outfile):
+		os.remove(outfile)  #Or the client asks before overwriting it
+	try:
+		srv=subprocess.Popen([sys.executable,"-u","dropdetect.py","-s","-i",SRV_ADDR,"-p",str(DATA_PORT)],
+			cwd=ROOT,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,text=True)
+		waitFor(srv,"Started server")
+		threading.Thread(target=srv.stdout.read,daemon=True).start()  #Keep the pipe drained
+		if cfg["scenario"]=="firewall":
+			fw=subprocess.Popen([sys.executable,"-u","firewall.py",FW_ADDR,SRV_ADDR]+firewallRules(start,end),
+				cwd=ROOT,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,text=True)
+			waitFor(fw,"Listening on")
+			threading.Thread(target=fw.stdout.read,daemon=True).start()
+		began=time.monotonic()
+		cli=subprocess.Popen([sys.executable,"dropdetect.py","--headless",
+			"-i",ip,"-p",str(DATA_PORT),
+			"-r",str(start),"-e",str(end),
+			"-c",str(cfg["chunk"]),"-t",str(cfg["timeout"]),"-d",str(cfg["delay"]),
+			"--engine="+cfg["engine"],"-o",outfile,"--format=json"]+(["-l"] if cfg["lockstep"] else []),
+			cwd=ROOT,stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+		sampler=Sampler(cli.pid)
+		killer=threading.Timer(RUN_TIMEOUT,cli.kill)
+		killer.start()
+		_,status,usage=os.wait4(cli.pid,0)
+		wall=time.monotonic()-began
+		killer.cancel()
+		sampler.stop()
+		cli.returncode=os.waitstatus_to_exitcode(status)
+	finally:
+		stopProc(fw)
+		stopProc(srv)
+	toret={**cfg,
+		"start":start,
+		"end":end,
+		"returncode":cli.returncode,
+		"timed_out":wall>=RUN_TIMEOUT,
+		"wall":round(wall,3),
+		"ports_per_sec":round(cfg["ports"]/wall,1),
+		"peak_threads":sampler.threads,
+		"peak_fds":sampler.fds,
+		"peak_rss_kb":usage.ru_maxrss}
+	toret.update(score(cfg["scenario"],outfile,start,end))
+	return toret
+def score(scenario,outfile,start,end):
+	'''Checks a JSON report against the ground truth'''
+	got={}
+	try:
+		with open(outfile) as f:
+			for name,rs in json.load(f)["results"].items():
+				for a,b in rs:
+					for p in range(a,b+1):
+						got[p]=name
+	except (OSError,ValueError,KeyError):
+		pass  #No report: every port counts as missed
+	wrong={}  #{"expected->got":count}
+	missing=0
+	for p in range(start,end):
+		want=truth(scenario,p,start)
+		if p not in got:
+			missing+=1
+		elif got[p]!=want:
+			key=f"{want}->{got[p]}"
+			wrong[key]=wrong.get(key,0)+1
+	bad=missing+sum(wrong.values())
+	return {"missing":missing,
+		"misclassified":wrong,
+		"error_rate":round(bad/(end-start),6)}
+
+def revision():
+	'''The git revision of the tree being benchmarked'''
+	try:
+		rev=subprocess.run(["git","rev-parse","--short","HEAD"],cwd=ROOT,capture_output=True,text=True,check=True).stdout.strip()
+		dirty=subprocess.run(["git","status","--porcelain","--untracked-files=no"],cwd=ROOT,capture_output=True,text=True).stdout.strip()
+	except (OSError,subprocess.CalledProcessError):
+		return "unknown"
+	return rev+("-dirty" if dirty else '')
+def compare(old_path,new_path):
+	'''Prints the change in every metric between two saved runs, matching runs by their settings'''
+	with open(old_path) as f:
+		old=json.load(f)
+	with open(new_path) as f:
+		new=json.load(f)
+	keys=list(MATRICES["full"])
+	olds={tuple(r[k] for k in keys):r for r in old["runs"]}
+	print(f"{old['revision']} -> {new['revision']}")
+	for r in new["runs"]:
+		o=olds.get(tuple(r[k] for k in keys))
+		if o==None:
+			continue
+		print(' '.join([f"{k}={r[k]}" for k in keys]))
+		for m in ("ports_per_sec","wall","peak_threads","peak_fds","peak_rss_kb","error_rate"):
+			change=f"{(r[m]-o[m])/o[m]*100:+.1f}%" if o[m] else ''
+			print(f"  {m:<14}{o[m]:>12} -> {r[m]:<12}{change}")
+
+if __name__=="__main__":
+	if len(sys.argv)>1 and sys.argv[1]=="compare":
+		compare(sys.argv[2],sys.argv[3])
+		exit(0)
+	matrix=MATRICES[sys.argv[1] if len(sys.argv)>1 else "quick"]
+	out_dir=sys.argv[2] if len(sys.argv)>2 else os.path.join(ROOT,"bench","results")
+	os.makedirs(out_dir,exist_ok=True)
+	rev=revision()
+	runs=[]
+	report=os.path.join(out_dir,f".report-{os.getpid()}.json")
+	for values in itertools.product(*matrix.values()):
+		cfg=dict(zip(matrix,values))
+		m=run(cfg,report)
+		runs.append(m)
+		print(f"{m['scenario']:<9}ports={m['ports']:<6}chunk={m['chunk']:<5}t={m['timeout']} d={m['delay']:<4}{m['engine']:<7}{'-l ' if m['lockstep'] else '   '}"
+			f"{m['wall']:8.2f}s {m['ports_per_sec']:9.1f} ports/s  threads={m['peak_threads']:<4}fds={m['peak_fds']:<5}"
+			f"rss={m['peak_rss_kb']/1024:.1f}MB  errors={m['error_rate']*100:.2f}%{'  TIMED OUT' if m['timed_out'] else ''}")
+	if os.path.exists(report):
+		os.remove(report)
+	path=os.path.join(out_dir,f"scan-{rev}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+	with open(path,'w') as f:
+		json.dump({"revision":rev,
+			"date":time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"host":socket.gethostname(),
+			"cpus":os.cpu_count(),
+			"python":sys.version.split()[0],
+			"runs":runs},f,indent=1)
+	print(f"[|X:{MY_NAME}]: Saved {len(runs)} runs to {path}")
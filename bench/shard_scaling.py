@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Measures how the sharded client scales from 1 to N processes
+## Notes:
+##  - Run from the repo root: python bench/shard_scaling.py [ports] [max procs] [engine]
+##  - A server.ListenerPool answers every probe on loopback, so every port should come back ACCEPTED
+##  - Ports start at 30000 to stay clear of well-known ports
+import sys,os,time,threading,socket
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import globe,server,shard,results
+
+BASE=30000
+
+class NullScreen():
+	'''Stands in for grid.Grid; nothing is drawn'''
+	def __getattr__(self,name):
+		return lambda *a,**k:None
+
+def run(procs,ports,engine,chunk=500):
+	'''Scans ports with procs workers. Returns (seconds,accepted)'''
+	globe.results=results.ResultStore()
+	pool=shard.ShardPool(procs,2000,engine)
+	screen=NullScreen()
+	start=time.monotonic()
+	for i in range(0,len(ports),chunk):
+		pool.minion("127.0.0.1",ports[i:i+chunk],3,0,screen,1)
+	pool.join()
+	return (time.monotonic()-start,globe.results.sums()["accept"])
+
+if __name__=="__main__":
+	n=int(sys.argv[1]) if len(sys.argv)>1 else 5000
+	max_procs=int(sys.argv[2]) if len(sys.argv)>2 else os.cpu_count()
+	engine=sys.argv[3] if len(sys.argv)>3 else "async"
+	ports=range(BASE,BASE+n)
+	#Server side: one pool listening on every port until we say stop
+	listeners=server.ListenerPool("127.0.0.1",list(ports),3)
+	listeners.open()
+	stop_r,stop_w=socket.socketpair()
+	serving=threading.Thread(target=listeners.serve,args=(stop_r,),daemon=True)
+	serving.start()
+	procs=1
+	base=None
+	try:
+		while procs<=max_procs:
+			t,accepted=run(procs,ports,engine)
+			base=base or t
+			print(f"procs={procs:<3} {t:7.2f}s  {n/t:9.0f} ports/s  speedup={base/t:4.2f}x  accepted={accepted}/{n}")
+			procs*=2
+	finally:
+		stop_w.send(b'x')
+		serving.join()
+		listeners.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Microbenchmark for the data.Unit codec
+## Notes:
+##  - Run from the repo root: python bench/unit_codec.py
+##  - "legacy" is a copy of the hex/concatenation codec data.Unit used before the struct rewrite,
+##    kept here only so the two can be compared
+##  - Two measurements, each against its own legacy run:
+##      round trip: build a unit with a payload, then parse it back
+##      probe:      the client's side of one probe: build the OK unit it sends, then check the server's 17 byte reply
+##  - "shim" is data.Unit (the compatibility API). Every Unit is a Python object, and creating one costs
+##    a few hundred ns on its own, so the shim can't get much past 2x. Only the packed path gets to 5x
+import sys,os,timeit
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import data
+
+N=200000
+KEY=b'______main______'
+PAYLOAD=b'\x00\x00\x00\x07'
+REPLY=b'\x48'+KEY  #The server's OK
+
+#--------------#
+#    Legacy    #
+#--------------#
+def legacyIToB(i,length=1):
+	h=hex(i)[2:]
+	if len(h)%2==1:
+		h=f"0{h}"
+	toret=bytes.fromhex(h)
+	if len(toret)<length:
+		toret=b'\x00'*(length-len(toret))+toret
+	return toret
+def legacyBToI(b):
+	toret=0
+	for i in b:
+		toret=(toret<<8)+i
+	return toret
+class LegacyUnit():
+	def __init__(self,raw):
+		self.raw=raw
+		self.who_byte=self.raw[0:1]
+		target=self.who_byte[0]
+		self.who=target>>7
+		self.content=(target>>4)&0b111
+		self.status=target>>3&0b1
+		self.hasPayload=target>>2&0b1
+		self.key=self.raw[1:17]
+		self.payload=None
+	def compileWho(self):
+		self.who_byte=self.who<<7
+		self.who_byte+=self.content<<4
+		self.who_byte+=self.status<<3
+		self.who_byte+=self.hasPayload<<2
+		self.who_byte&=0b11111100
+		self.who_byte=legacyIToB(self.who_byte)
+	def setPayload(self,new):
+		self.payload=new
+		self.raw=self.raw[:17]
+		self.raw+=legacyIToB(len(self.payload),2)
+		self.raw+=self.payload
+
+def legacyRoundTrip():
+	unit=LegacyUnit(b'\x6c'+KEY)
+	unit.compileWho()
+	unit.setPayload(PAYLOAD)
+	raw=unit.raw
+	recv=LegacyUnit(raw[:17])
+	recv.payload=raw[19:19+legacyBToI(raw[17:19])]
+	return recv
+
+def legacyProbe():
+	ok=LegacyUnit(b'\xc8'+KEY).raw
+	unit=LegacyUnit(REPLY)
+	return unit.status and unit.key==KEY
+
+#---------------#
+#    Current    #
+#---------------#
+def shimRoundTrip():
+	'''Same steps, through the data.Unit compatibility API'''
+	unit=data.Unit(b'\x6c'+KEY)
+	unit.compileWho()
+	unit.setPayload(PAYLOAD)
+	return data.Unit(unit.raw)
+
+BUF=bytearray(64)
+VIEW=memoryview(BUF)
+def packedRoundTrip():
+	'''Same steps, packing into and unpacking from one reusable buffer'''
+	data.packUnit(VIEW,0x6c,KEY,PAYLOAD)
+	return data.unpackFrame(VIEW)  #Payload stays in BUF[19:19+n]
+
+def shimProbe():
+	'''Same steps, through the data.Unit compatibility API'''
+	ok=data.Unit(b'\xc8'+KEY).raw
+	unit=data.Unit(REPLY)
+	return unit.status and unit.key==KEY
+def probe():
+	'''Same steps, the way client.probePort, asyncscan.probePort and probe.probePorts do them'''
+	ok=data.okFrame(KEY)  #Built once per minion ID
+	return data.isOk(REPLY,KEY)
+
+BENCHES=(("round trip",(("legacy",legacyRoundTrip),("shim",shimRoundTrip),("packed",packedRoundTrip))),
+	("probe",(("legacy",legacyProbe),("shim",shimProbe),("probe",probe))))
+
+if __name__=="__main__":
+	for title,funcs in BENCHES:
+		print(f"{title}:")
+		results={}
+		for name,func in funcs:
+			results[name]=min(timeit.repeat(func,number=N,repeat=5))/N
+		for name,t in results.items():
+			print(f"  {name:>7}: {t*1e9:8.1f} ns/unit  ({results['legacy']/t:.1f}x legacy)")
@@ -6,22 +6,29 @@
 ##  - info_dict in the handshake must be {'b\xNN':b'\xVALUE'}
 ##    where \xNN is according to data.handshake_payload_types
 import socket,time,multiprocessing,random,os
-import data,grid,globe
+import data,grid,globe,probe,metrics,udp
 from misc import iToB,bToI
 
 MY_NAME=__file__[__file__.rfind('/')+1:-3]
 
-def doHandshake(serv_addr,data_port,info_dict,id=b'______main______'):
-	'''Complete handshake with server on defined data port'''
+def doHandshake(serv_addr,data_port,info_dict,id=b'______main______',ctl=None):
+	'''Complete handshake with server on defined data port.
+	If ctl (an rtt.Controller) is passed, it's fed the connect and first reply RTTs'''
 	cli=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
 	cli.settimeout(bToI(info_dict[b'\x00']))  #This should be the only one needed to be converted back to int
+	start=time.monotonic()
 	cli.connect((serv_addr,data_port))
+	if ctl:
+		ctl.sample(time.monotonic()-start)
 	# print(f"[|X:{MY_NAME}:doHandshake]: Starting handshake...")
 	unit=data.Unit(b'\x88'+id)
 	#Send unit
-	cli.send(unit.raw)
+	start=time.monotonic()
+	data.sendUnit(cli,unit)
 	#Get OK reply
 	reply=data.recvUnit(cli)
+	if ctl and reply:
+		ctl.sample(time.monotonic()-start)
 	if not reply.status or reply.content!=0:
 		# print(f"[|X:{MY_NAME}:doHandshake]: Bad reply from server!")
 		return None
@@ -31,10 +38,10 @@ def doHandshake(serv_addr,data_port,info_dict,id=b'______main______'):
 	unit=data.Unit(b'\x8c'+id)
 	for d in info_dict.items():
 		unit.setPayload(d[0]+d[1])
-		cli.send(unit.raw)
+		data.sendUnit(cli,unit)
 	#Send finished message
 	unit.setPayload(b'\xff')
-	cli.send(unit.raw)
+	data.sendUnit(cli,unit)
 	#Get OK from server
 	recv=data.recvUnit(cli)
 	if not recv.status:
@@ -47,93 +54,157 @@ def doHandshake(serv_addr,data_port,info_dict,id=b'______main______'):
 	# print(f"[|X:{MY_NAME}:doHandshake]: Finished handshake!")
 	return cli
 
-def tryPort(id,addr,port,timeout,delay):
+def tryPort(id,addr,port,timeout,delay,tries=3):
 	'''Tries conencting to a port.
+	A refused connection is retried tries times, with delay seconds between each.
 	Returns an int:
 		0=ACCEPTED
 		1=CLOSED
 		2=DROPPED
 		3=SERVER ERROR (Bad reply)
 	'''
+	return probePort(id,addr,port,timeout,delay,tries)[0]
+
+def probePort(id,addr,port,timeout,delay,tries=3,ctl=None):
+	'''Same as tryPort, but returns (result,latency,attempts).
+	latency is the connect time in seconds, or None if we never connected.
+	If ctl (an rtt.Controller) is passed, it picks the timeout and delay, and is fed the results'''
 	# print(f"[|X:{MY_NAME}:tryPort]: Trying port {port}...")
-	counter=3
+	if ctl:
+		timeout=ctl.timeout()
+		delay=ctl.retryDelay()
+	res,latency,attempts=_probePort(id,addr,port,timeout,delay,tries)
+	if ctl:
+		if latency!=None:
+			ctl.sample(latency)
+		ctl.record(res)
+	return (res,latency,attempts)
+
+def _probePort(id,addr,port,timeout,delay,tries):
+	'''Does the actual probing for probePort'''
+	counter=tries
+	attempts=0
 	while counter>0:
+		attempts+=1
 		try:
 			#Create socket
 			client=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
 			client.settimeout(timeout)
+			start=time.monotonic()
 			client.connect((addr,port))
+			latency=time.monotonic()-start
 			# print(f"[|X:{MY_NAME}:tryPort]: Connected!")
 			break
 		except socket.timeout:
 			# print(f"[|X:{MY_NAME}:tryPort]: Timeout!")
-			return 2
+			client.close()
+			return (2,None,attempts)
 		except (ConnectionRefusedError,ConnectionResetError):
 			# print(f"[|X:{MY_NAME}:tryPort]:({port}) Closed!")
-			time.sleep(delay)
+			client.close()
+			if counter>1:  #No point waiting after the last try
+				time.sleep(delay)
 		except ConnectionAbortedError:  #Generic error, isn't an issue
+			client.close()
 			continue  #Skip counter decrement
 		counter-=1
 	if counter==0:  #Not timeout, but couldn't connect
 		# print(f"[|X:{MY_NAME}:tryPort]: Couldn't establish connection!")
-		return 1
-	#Send OK
-	unit=data.Unit(b'\xc8'+id)
-	client.send(unit.raw)
-	#Get OK
+		return (1,None,attempts)
+	if globe.ledger:  #Fast mode: connecting is enough, the server's ledger confirms it later
+		globe.ledger.probe(port,client.getsockname())
+		client.close()
+		return (0,latency,attempts)
 	try:
-		recv_data=data.recvFrom(client,17)
-		if recv_data==b'':  #Socket closed by server, but we are still open. We will assume this as "SRVERR" (as this is normally "port in use")
-			return 3
-		unit=data.Unit(recv_data)  #Only expecting 17 bytes
-	except ConnectionResetError:  #Socket closed unexpectedly
-		return 3
-	if unit.status and unit.key==id:
-		# print(f"[|X:{MY_NAME}:tryPort]: {id}: Got OK on port {port}")
-		return 0
-	else:
-		# print(f"[|X:{MY_NAME}:tryPort]: {id}: Got BAD on port {port}")
-		return 3  #Technically, this did go through
-	#Close socket
-	client.close()
-
-def minion_thread(data_addr,ports,timeout,delay,screen,sums):
+		#Send OK
+		client.send(data.okFrame(id))
+		#Get OK
+		try:
+			recv_data=data.recvFrom(client,17)  #Only expecting 17 bytes
+			if not recv_data:  #Socket closed by server (or timed out), but we are still open. We will assume this as "SRVERR" (as this is normally "port in use")
+				return (3,latency,attempts)
+		except ConnectionResetError:  #Socket closed unexpectedly
+			return (3,latency,attempts)
+		if data.isOk(recv_data,id):
+			# print(f"[|X:{MY_NAME}:tryPort]: {id}: Got OK on port {port}")
+			return (0,latency,attempts)
+		else:
+			# print(f"[|X:{MY_NAME}:tryPort]: {id}: Got BAD on port {port}")
+			return (3,latency,attempts)  #Technically, this did go through
+	finally:
+		#Close socket
+		client.close()
+
+def minion_thread(data_addr,ports,timeout,delay,screen,tries=3,ctl=None):
 	'''Main thread for threads spawned from thread_manager_main'''
 	#Generate ID
 	my_id=b''
 	for i in range(16):
 		my_id+=iToB(random.randint(0,255))
-	unit=data.Unit(b'\x58'+my_id)
 
-	my_sums={"accept":0,"close":0,"drop":0,"srverr":0}  #Dict to update grid
-	# toret={"close":[],"drop":[],"srverr":[]}
 	for p in ports:
 		# print(f"[|X:{MY_NAME}:minion_thread]: Trying port {p}...")
-		res=tryPort(my_id,data_addr,p,timeout,delay)
-		if res==0:  #Accepted
-			my_sums["accept"]+=1
-			globe.all_lists["accept"].append(p)
-		elif res==1:  #Closed
-			my_sums["close"]+=1
-			globe.all_lists["close"].append(p)
-		elif res==2:  #Dropped/Anything else
-			my_sums["drop"]+=1
-			globe.all_lists["drop"].append(p)
-		else:
-			my_sums["srverr"]+=1
-			globe.all_lists["srverr"].append(p)
-		# print()
-	#Printing results
-	globe.LOCK.acquire()
-	screen.goTo(0,1)
-	for s in sums:
-		sums[s]+=my_sums[s]
-		screen.write(sums[s])
-	screen.goTo(1,4)
-	globe.thread_count-=1
-	screen.write(globe.thread_count)
-	globe.LOCK.release()
-	# return toret
+		if ctl:
+			ctl.acquire()
+		if globe.pacer:
+			globe.pacer.acquire(data_addr,p)
+		metrics.INFLIGHT.inc()
+		try:
+			res,latency,attempts=probePort(my_id,data_addr,p,timeout,delay,tries,ctl)
+		finally:
+			metrics.INFLIGHT.dec()
+			if ctl:
+				ctl.release()
+		globe.results.set(p,res,latency,attempts)
+	chunkDone(screen)
+
+def epoll_thread(data_addr,ports,timeout,screen,ctl=None):
+	'''Same as minion_thread, but probes the whole chunk at once through probe.probePorts.
+	Refused ports aren't retried'''
+	my_id=random.randbytes(16) if not globe.ledger else None  #Connect-only in fast mode
+	if ctl:
+		timeout=ctl.timeout()
+	metrics.INFLIGHT.inc(len(ports))
+	try:
+		results=probe.probePorts(data_addr,ports,timeout,my_id,ctl.limit if ctl else 1000,globe.ledger.probed if globe.ledger else None,globe.pacer)
+	finally:
+		metrics.INFLIGHT.dec(len(ports))
+	for p,(res,latency) in results.items():
+		if ctl:
+			if latency!=None:
+				ctl.sample(latency)
+			ctl.record(res)
+		globe.results.set(p,res,latency,1)
+	chunkDone(screen)
+
+def udp_thread(data_addr,ports,timeout,screen,ctl=None):
+	'''Same as epoll_thread, but over UDP (see udp.probePorts)'''
+	if ctl:
+		timeout=ctl.timeout()
+	metrics.INFLIGHT.inc(len(ports))
+	try:
+		results=udp.probePorts(data_addr,ports,timeout,random.randbytes(16),pace=globe.pacer)
+	finally:
+		metrics.INFLIGHT.dec(len(ports))
+	for p,(res,latency,attempts) in results.items():
+		if ctl:
+			if latency!=None:
+				ctl.sample(latency)
+			ctl.record(res)
+		globe.results.set(p,res,latency,attempts)
+	chunkDone(screen)
+
+def chunkDone(screen):
+	'''Marks a chunk finished.
+	Only the counters change; the screen's renderer picks them up on its next frame (see drawSums)'''
+	with globe.LOCK:
+		globe.thread_count-=1
+
+def drawSums(screen):
+	'''Sets the sums and thread count cells. Called by the screen's renderer before every frame'''
+	for i,count in enumerate(globe.results.sums().values()):
+		screen.renderer.set(i,1,count)
+	screen.renderer.set(1,4,globe.thread_count)
 
 def heartbeat(cli,bps=3):
 	'''Main thread to start a heartbeat and allow sending messages to/from server'''
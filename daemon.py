@@ -0,0 +1,248 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Long-lived server handling many clients at once
+## Notes:
+##  - One thread per client session does the handshake and hands out ports (server.serveSession)
+##  - Sessions are keyed by the client's main_id. A second client with an ID already in use is refused (SESSION_IN_USE)
+##  - Before a session listens on a window, it reserves every port in it. Reservations are all-or-nothing,
+##    so a session waits for another session's window to close instead of fighting it for a listener
+##  - Every session's listeners, accepted connections, and lock-step stop sockets are driven by one selector,
+##    in one event loop thread. Other threads never touch the selector: they queue calls for the loop and wake it
+import socket,selectors,threading,time
+import concurrent.futures
+import server,metrics,profiling
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+
+class Daemon():
+	def __init__(self,addr="0.0.0.0",port=8080):
+		self.addr=addr
+		self.port=port
+		self.sessions={}  #{main_id:client address}
+		self.reserved={}  #{port:main_id}
+		self.lock=threading.Lock()
+		self.cond=threading.Condition(self.lock)
+		self.loop=EventLoop()
+
+	def run(self):
+		'''Accepts clients forever, one session thread each'''
+		serv=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		serv.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		serv.bind((self.addr,self.port))
+		serv.listen()
+		self.loop.start()
+		print(f"[|X:{MY_NAME}:run]: Started daemon on {self.addr}:{self.port}")
+		try:
+			while True:
+				cli,cli_addr=serv.accept()
+				print(f"[|X:{MY_NAME}:run]: Got connection from {cli_addr}!")
+				threading.Thread(target=profiling.wrap(self.session),args=(cli,cli_addr),daemon=True).start()
+		finally:
+			serv.close()
+			self.loop.stop()
+
+	def session(self,cli,cli_addr):
+		'''Session thread: handshake, then serve the client's ports'''
+		def claim(info_dict):
+			with self.lock:
+				if info_dict["main_id"] in self.sessions:
+					return b'SESSION_IN_USE'
+				self.sessions[info_dict["main_id"]]=cli_addr
+			return None
+		try:
+			info_dict=server.handshake(cli,claim)
+		except PermissionError:
+			return None
+		if info_dict==None:
+			return None
+		main_id=info_dict["main_id"]
+		try:
+			done=server.serveSession(cli,
+				info_dict,
+				self.addr,
+				windows=lambda ports,timeout,ldg,udp:DaemonWindow(self,main_id,ports,timeout,ldg,udp))
+			print(f"[|X:{MY_NAME}:session]: {cli_addr} {'done' if done else 'failed'}")
+			return done
+		finally:
+			with self.cond:
+				del self.sessions[main_id]
+				#Anything a dead session left reserved
+				for p in [p for p,o in self.reserved.items() if o==main_id]:
+					del self.reserved[p]
+				self.cond.notify_all()
+
+	def reserve(self,main_id,ports):
+		'''Blocks until no other session holds any of ports, then holds all of them'''
+		with self.cond:
+			while any(self.reserved.get(p,main_id)!=main_id for p in ports):
+				self.cond.wait()
+			for p in ports:
+				self.reserved[p]=main_id
+	def release(self,main_id,ports):
+		'''Frees ports reserved by reserve'''
+		with self.cond:
+			for p in ports:
+				if self.reserved.get(p)==main_id:
+					del self.reserved[p]
+			self.cond.notify_all()
+
+class EventLoop():
+	'''One selector for every session's sockets.
+	Registered data is (window,(port,buf)), and events are handed to the window's _accept/_read'''
+	def __init__(self):
+		self.sel=selectors.DefaultSelector()
+		self.calls=[]  #[(func,args,concurrent.futures.Future)]
+		self.calls_lock=threading.Lock()
+		self.wake_r,self.wake_w=socket.socketpair()
+		self.wake_r.setblocking(False)
+		self.sel.register(self.wake_r,selectors.EVENT_READ,(None,None))
+		self.windows=set()  #Open windows
+		self.thread=threading.Thread(target=profiling.wrap(self._run),daemon=True)
+		self.running=False
+	def start(self):
+		self.running=True
+		self.thread.start()
+	def stop(self):
+		self.call(setattr,self,"running",False)
+	def call(self,func,*args):
+		'''Runs func(*args) in the loop thread.
+		Returns a concurrent.futures.Future'''
+		fut=concurrent.futures.Future()
+		with self.calls_lock:
+			self.calls.append((func,args,fut))
+		self.wake_w.send(b'\x00')
+		return fut
+
+	def _run(self):
+		while self.running:
+			#Wake up in time for the next idle window. Finished ones (waiting to be closed) have no deadline
+			idle=[w.last+w.idle for w in self.windows if w.stop==None and not w.done.is_set()]
+			wait=max(0,min(idle)-time.monotonic()) if idle else None
+			for key,_ in self.sel.select(wait):
+				win,(p,buf)=key.data if key.data[0] else (None,(None,None))
+				if win==None:  #Woken up
+					try:
+						self.wake_r.recv(4096)
+					except BlockingIOError:
+						pass
+					continue
+				if win.done.is_set():  #Already finished, but not closed yet
+					continue
+				if p==None:  #Stop socket
+					win.sel.unregister(key.fileobj)
+					win.stopped=True
+					win._finish()
+					continue
+				win.last=time.monotonic()
+				if buf==None:
+					win._accept(key.fileobj,p)
+				else:
+					win._read(key.fileobj,p,buf)
+				if win.stop==None and len(win.served)>=len(win.listeners):
+					win._finish()
+			#Time out idle windows
+			now=time.monotonic()
+			for w in self.windows:
+				if w.stop==None and not w.done.is_set() and now-w.last>=w.idle:
+					w._finish()
+			self._runCalls()
+		self.sel.close()
+	def _runCalls(self):
+		with self.calls_lock:
+			calls,self.calls=self.calls,[]
+		for func,args,fut in calls:
+			try:
+				fut.set_result(func(*args))
+			except Exception as e:
+				fut.set_exception(e)
+
+class _View():
+	'''The part of the loop's selector a window can see.
+	Gives server.ListenerPool the selector calls it expects'''
+	def __init__(self,loop,win):
+		self.loop=loop
+		self.win=win
+		self.keys={}  #{socket:selectors.SelectorKey}, this window's only
+		self.parked=[]  #Sockets taken out of the selector by park, still open
+	def register(self,fileobj,events,data):
+		self.keys[fileobj]=self.loop.sel.register(fileobj,events,(self.win,data))
+		return self.keys[fileobj]
+	def unregister(self,fileobj):
+		del self.keys[fileobj]
+		return self.loop.sel.unregister(fileobj)
+	def park(self):
+		'''Takes every socket but the stop socket out of the selector, without closing them.
+		A finished window's EOFs and late connects would otherwise wake the loop up until it's closed'''
+		for fileobj,key in list(self.keys.items()):
+			if key.data[1][0]!=None:
+				self.unregister(fileobj)
+				self.parked.append(fileobj)
+
+class DaemonWindow(server.ListenerPool):
+	'''A ListenerPool on the daemon's event loop, with its ports reserved for one session'''
+	def __init__(self,daemon,main_id,ports,timeout,ldg=None,udp=False):
+		super().__init__(daemon.addr,ports,timeout,ldg,udp)
+		self.sel.close()  #Everything goes through the loop's selector instead
+		self.daemon=daemon
+		self.main_id=main_id
+		self.loop=daemon.loop
+		self.sel=_View(self.loop,self)
+		self.idle=timeout*2
+		self.last=time.monotonic()
+		self.stop=None
+		self.stopped=False
+		self.done=threading.Event()
+		self.reserved=False
+	def open(self):
+		'''Reserve every port in the window, then listen on them from the loop'''
+		self.daemon.reserve(self.main_id,self.ports)
+		self.reserved=True
+		self.last=time.monotonic()
+		return self.loop.call(self._open).result()
+	def _open(self):
+		toret=super().open()
+		self.loop.windows.add(self)
+		return toret
+	def serve(self,stop=None):
+		'''Same as ListenerPool.serve, but waits on the loop'''
+		if stop:
+			self.loop.call(self._setStop,stop).result()
+		self.done.wait()
+		if stop:
+			self.loop.call(self._clearStop,stop).result()
+		return self.stopped
+	def _setStop(self,stop):
+		self.stop=stop
+		self.sel.register(stop,selectors.EVENT_READ,(None,None))
+	def _finish(self):
+		'''Loop thread: the window is done. Its sockets stay open (the ledger may still drain them) until close'''
+		self.done.set()
+		self.sel.park()
+	def _clearStop(self,stop):
+		if stop in self.sel.keys:
+			self.sel.unregister(stop)
+		self.stop=None
+	def close(self):
+		'''Close the window's sockets from the loop, then give its ports back'''
+		self.done.set()
+		if threading.current_thread()==self.loop.thread or not self.loop.thread.is_alive():
+			self._close()
+		else:
+			self.loop.call(self._close).result()
+		if self.reserved:
+			self.daemon.release(self.main_id,self.ports)
+			self.reserved=False
+	def _close(self):
+		self.loop.windows.discard(self)
+		if self.ledger:
+			self._drain()
+		for key in list(self.sel.keys.values()):
+			if key.data[1][0]!=None:  #Not the stop socket
+				self.sel.unregister(key.fileobj)
+				key.fileobj.close()
+		for s in self.sel.parked:
+			s.close()
+		self.sel.parked=[]
+		metrics.LISTENERS.dec(len(self.listeners))
+		self.listeners={}
@@ -21,6 +21,8 @@
     2: Port response
     4: Informational message
     5: Generic media message
+    6: Window control (lock-step mode)
+    7: Accept ledger (fast mode)
   4:  #Message status, normally only for replies
     0: Status BAD
     1: Status OK
@@ -43,16 +45,43 @@ __--++* Payload Format *++--__
     [2]: Number describing the data in the payload
     [3-n]: Payload data (No requirement to exist)
   - A "port request" has no payload.
-  - A "port reply" payload follows:
+  - A "port reply" payload follows (port_format=0, legacy):
     [bytes (inclusive)]
     [0-1]: Message length (excluding these 2 bytes)
     [2-3]: Number of ports in this message
     [4-n]: Ports, each 2 bytes in length
+  - A "port reply" payload follows (port_format=1, compact):
+    [bytes (inclusive)]
+    [0-1]: Message length (excluding these 2 bytes)
+    [2]: Encoding of the ports:
+      00: No more ports (nothing follows)
+      01: Ranges
+        [3-4]: Number of ranges
+        [5-n]: Ranges, each as a 2 byte start and a 2 byte end (both inclusive)
+      02: Bitmap
+        [3-4]: Base port
+        [5-n]: Bitmap. The MSB of byte 5 is the base port, the next bit is base+1, etc...
+      03: Explicit list
+        [3-n]: Ports, each 2 bytes in length
+    The server uses whichever encoding is smallest
   - An "informational message" payload follows:
     [bytes (inclusive)]
     [0-1]: Message length (excluding these 2 bytes)
     [2-n]: Text message describing information
   - A "generic media message" has no payload.
+  - A "window control" payload follows:
+    [bytes (inclusive)]
+    [0-1]: Message length (excluding these 2 bytes)
+    [2-5]: Window number
+  - An "accept ledger" payload follows:
+    [bytes (inclusive)]
+    [0-1]: Message length (excluding these 2 bytes)
+    [2-n]: Entries, 12 bytes each (see ledger.ENTRY):
+      [0-1]:  Port the server accepted on
+      [2-5]:  Peer IPv4 address
+      [6-7]:  Peer port
+      [8-11]: Milliseconds since the session started
+    An empty ledger payload (length 0) is the last one
 __--++* Handshake Format *++--__
   - Client reaches out to server with content=0 (handshake) and who=1 (client)
   - Server replies with content=0, status=1, and who=0.
@@ -63,12 +92,64 @@ __--++* Handshake Format *++--__
     The handshake is complete at this stage
   - Handshake data values (byte 2 of payload):
     - 00: timeout
-	- ff: handshake done
+    - 01: port_start
+    - 02: port_end
+    - 03: port_chunk
+    - 04: lockstep (1=on)
+    - 05: port_format (see Port Reply Format). The server refuses formats it doesn't know
+    - 06: port_order (0=seq, 1=random, 2=stride)
+    - 07: port_seed (4 bytes). Seeds the random order, so both sides walk the same permutation
+    - 08: port_skip. Ports the client already has results for (--resume), in the compact port reply encoding.
+          The server leaves them out of every chunk
+    - 09: port_directed (1=on). The client may pick its own ports (see Port Reply Format)
+    - 0a: port_credit. Port replies the server may send ahead of port requests (see Port Credits). 0=off
+    - 0b: fast (1=on). Connect-only probes, checked against the server's accept ledger (see Accept Ledger)
+    - 0c: udp (1=on). Windows are UDP sockets instead of TCP listeners (see UDP Probes)
+    - ff: handshake done
 __--++* Port Reply Format *++--__
   - Client sends port request
+  - If port_directed=1 and the request has a payload, the payload lists the ports the client wants next
+    (compact encoding, see port_format 1). The server replies with the ones inside the agreed range.
+    A request for no ports (byte 2=\x00) means the client is done, and the server replies with an empty port reply
   - If the server has any ports to return, send a standard port reply
-  - If the server has exausted all ports, reply with an empty port reply (bytes 2-3=\x00\x00 w/ no ports list)
+  - If the server has exausted all ports, reply with an empty port reply
+    (port_format 0: bytes 2-3=\x00\x00 w/ no ports list, port_format 1: byte 2=\x00)
     No further communication will be done from here and both sides should close the data connection
+__--++* Lock-step Windows *++--__
+  - Only used if the client sent lockstep=1 during the handshake
+  - After every non-empty port reply, the server binds and listens on all of those ports (the window)
+  - Once every listener is up, the server sends a window control unit (who=0, status=1) with the window number.
+    Window numbers start at 0 and go up by one per port reply
+  - The client probes exactly that window, then sends a window control unit (who=1, status=1) with the same number
+  - Only then does the server close the window's listeners and wait for the next port request
+__--++* Port Credits *++--__
+  - Only used if the client sent port_credit=K>0 during the handshake, without lockstep or port_directed
+    (a window has to be finished, and a directed request read, before the next port reply makes sense)
+  - Right after the handshake, the server sends K port replies without waiting for port requests
+  - Every port request the client sends after that returns one credit, and the server answers it with one more port reply.
+    The client sends one as soon as it takes a reply, so K replies are always on their way and
+    handing out chunks never waits on a round trip
+  - The empty port reply still ends it. Requests still in flight then are never answered
+__--++* Accept Ledger *++--__
+  - Only used if the client sent fast=1 during the handshake
+  - The client probes by connecting and hanging up (no OK units). The server accepts, writes the connection
+    down in its ledger, and hangs up too. Before a window closes, anything still in its accept queues is accepted
+  - The server sends new ledger entries as accept ledger units (who=0, status=1):
+    before every port reply, after every lock-step window, and once every port was served.
+    Then it sends an empty one, and the ledger is complete
+  - The client takes ledger units whenever they arrive, and once it has the empty one,
+    every ACCEPTED port the server has no entry for becomes SRVERR
+__--++* UDP Probes *++--__
+  - Only used if the client sent udp=1 during the handshake. The client always uses lockstep with it
+  - Each window binds a UDP socket on every port instead of listening on it
+  - A probe is one datagram: an informational unit (who=1, status=1) with the client's ID, and a payload of:
+    [bytes (inclusive)]
+    [0-1]: Message length (always 3)
+    [2-3]: Port the probe was sent to
+    [4]:   Retry round it was sent in (0 is the first)
+  - The server echoes it from the same port, only changing the who byte to its own (who=0, status=1)
+  - An echo with the client's ID is ACCEPTED. ICMP port unreachable is CLOSED.
+    Anything else coming back from the port is SRVERR, and nothing at all after every retry round is DROPPED
 
 __--++* Heartbeat *++--__
   - The heartbeat is a thread that will allow both server and client to ensure either exists.
@@ -80,24 +161,65 @@ __--++* Heartbeat *++--__
   - Both parties are allowed to send informational messages during the heartbeat, which should be interpreted as required.
   - If one party doesn't reply, assume they have died, and finish our own processes
 '''
-import socket
-import payload
+import socket,struct,itertools,random,functools
+import payload,metrics
 from misc import iToB, bToI
 
+#------------#
+#    Unit    #
+#------------#
+HEADER=struct.Struct(">B16s")  #Who byte + key
+LENGTH=struct.Struct(">H")  #Payload length
+FRAME=struct.Struct(">B16sH")  #Header + payload length, for units with a payload
+_packHeader=HEADER.pack_into
+_packFrame=FRAME.pack_into
+_unpackHeader=HEADER.unpack_from
+_unpackFrame=FRAME.unpack_from
+_packLength=LENGTH.pack
+_BYTES=[bytes((i,)) for i in range(256)]  #Single byte objects, so the who byte is never reallocated
+_WHO=[(i>>7,(i>>4)&0b111,i>>3&0b1,i>>2&0b1) for i in range(256)]  #(who,content,status,hasPayload) of every who byte
+_EMPTY=b'\x00'*17  #What Unit() starts from
+
+def packUnit(buf,who_byte,key,body=None,offset=0):
+	'''Packs a unit into buf (a bytearray or writable memoryview) at offset.
+	who_byte is an int, body is the payload (if any).
+	Returns the number of bytes written'''
+	if body==None:
+		_packHeader(buf,offset,who_byte,key)
+		return 17
+	n=len(body)
+	_packFrame(buf,offset,who_byte,key,n)
+	buf[offset+19:offset+19+n]=body
+	return 19+n
+#The struct methods themselves, so unpacking costs no extra call
+unpackHeader=_unpackHeader  #(buf,offset=0): Unpacks the 17 byte header at offset of buf without copying it. Returns (who_byte,key), who_byte an int
+unpackFrame=_unpackFrame  #(buf,offset=0): Unpacks the header and payload length of a unit with a payload, leaving the payload at offset+19. Returns (who_byte,key,length)
+
+@functools.lru_cache(maxsize=1024)
+def okFrame(id):
+	'''Returns the OK unit a client sends on every probe connection, as bytes.
+	Cached, so it's built once per minion ID instead of once per port'''
+	return HEADER.pack(0xc8,id)
+def isOk(buf,id):
+	'''Returns True if buf is an OK unit (17 bytes, status OK) with key id, without building a Unit'''
+	if not buf or len(buf)!=17:
+		return False
+	who_byte,key=_unpackHeader(buf)
+	return bool(who_byte>>3&0b1) and key==id
+
 class Unit():
+	__slots__=("raw","who_byte","who","content","status","hasPayload","key","payload")
 	def __init__(self,raw=None):
-		if raw==None:
-			self.raw=b'\x00'*17
+		#Same as parse, inlined since the call costs about as much as the parsing
+		self.raw=raw=raw or _EMPTY
+		if raw[0]&0b100 and len(raw)>=19:
+			who_byte,self.key,n=_unpackFrame(raw)
+			self.payload=raw[19:19+n]
 		else:
-			self.raw=raw
-		self.who_byte=None  #Byte
-		self.who=None  #Int
-		self.content=None  #Int
-		self.status=None  #Int
-		self.hasPayload=None  #Int
-		self.key=None  #Bytes
-		self.payload=None  #Bytes
-		self.parse()
+			who_byte,self.key=_unpackHeader(raw)
+			self.payload=None
+		self.who_byte=_BYTES[who_byte]
+		self.who,self.content,self.status,self.hasPayload=_WHO[who_byte]
 	def __str__(self):
 		return f"""Who Byte: {self.who_byte} ({bin(self.who_byte[0])[2:]:>08})
 Key: {self.key}
@@ -106,8 +228,21 @@ Raw: {self.raw}"""
 	def __repr__(self):
 		return self.__str__()
 	def __len__(self):
+		if self.raw==None:  #Built by fromHeader
+			return 17 if self.payload==None else 19+len(self.payload)
 		return len(self.raw)
 
+	@classmethod
+	def fromHeader(cls,who_byte,key,payload=None):
+		'''Builds a unit from already unpacked fields, skipping self.raw.
+		who_byte is an int'''
+		self=cls.__new__(cls)
+		self.raw=None
+		self.key=key
+		self.payload=payload
+		self.who_byte=_BYTES[who_byte]
+		self.who,self.content,self.status,self.hasPayload=_WHO[who_byte]
+		return self
 	def payloadLen(self):
 		'''Get length of payload, or 0 if none exists'''
 		try:
@@ -116,18 +251,18 @@ Raw: {self.raw}"""
 			return 0
 	def parse(self):
 		'''Parses self.raw'''
-		self.who_byte=self.raw[0:1]
-		self.parseWho()
-		self.key=self.raw[1:17]
-		if self.hasPayload:
-			self.payload=self.raw[17:]
+		raw=self.raw
+		if raw[0]&0b100 and len(raw)>=19:
+			who_byte,self.key,n=_unpackFrame(raw)
+			self.payload=raw[19:19+n]
+		else:
+			who_byte,self.key=_unpackHeader(raw)
+			self.payload=None
+		self.who_byte=_BYTES[who_byte]
+		self.who,self.content,self.status,self.hasPayload=_WHO[who_byte]
 	def parseWho(self):
 		'''Parse self.who_byte'''
-		target=self.who_byte[0]
-		self.who=target>>7
-		self.content=(target>>4)&0b111
-		self.status=target>>3&0b1
-		self.hasPayload=target>>2&0b1
+		self.who,self.content,self.status,self.hasPayload=_WHO[self.who_byte[0]]
 	def getMessage(self):
 		'''Returns a string if this unit has informational content type, error otherwise'''
 		if self.content==4 and self.hasPayload:
@@ -137,30 +272,28 @@ Raw: {self.raw}"""
 	def compile(self):
 		'''Compile all variables into self.raw.
 		Also compiles who_byte'''
-		self.raw=b''
 		self.compileWho()
-		self.raw+=self.who_byte
-		self.raw+=self.key
-		if self.hasPayload:
-			self.raw+=self.payload
+		if self.hasPayload and self.payload!=None:
+			self.raw=HEADER.pack(self.who_byte[0],self.key)+LENGTH.pack(len(self.payload))+self.payload
+		else:
+			self.raw=HEADER.pack(self.who_byte[0],self.key)
 	def compileWho(self):
 		'''Compiles who variables into who_byte'''
-		self.who_byte=self.who<<7
-		self.who_byte+=self.content<<4
-		self.who_byte+=self.status<<3
-		self.who_byte+=self.hasPayload<<2
-		self.who_byte&=0b11111100
-		self.who_byte=iToB(self.who_byte)
+		self.who_byte=_BYTES[((self.who<<7)|(self.content<<4)|(self.status<<3)|(self.hasPayload<<2))&0b11111100]
+	def pack(self,buf,offset=0):
+		'''Packs this unit into buf at offset without building self.raw.
+		Returns the number of bytes written'''
+		return packUnit(buf,self.who_byte[0],self.key,self.payload if self.hasPayload else None,offset)
 	def setWhoByte(self,new):
 		'''Sets who_byte, then parses it'''
 		if type(new)==int:
-			new=iToB(new)
+			new=_BYTES[new]
 		self.who_byte=new
 		self.parseWho()
 	def _setWhoBit(self,new,pos,*,bits=1):
 		'''Sets a single bit in the who_byte'''
 		new_byte=self.who_byte[0]&~(((2**(bits))-1)<<pos)^(new<<pos)
-		self.who_byte=iToB(new_byte)
+		self.who_byte=_BYTES[new_byte&0xff]
 	def setWho(self,new):
 		'''Sets self.who, then updates who_byte'''
 		self.who=new
@@ -181,37 +314,170 @@ Raw: {self.raw}"""
 		'''Sets self.payload, then updates self.raw by removing an existing payload and appending the new one.
 		Note that this function automatically prepends the payload length to the bytes'''
 		self.payload=new
-		self.raw=self.raw[:17]
-		self.raw+=iToB(len(self.payload),2)
-		self.raw+=self.payload
+		self.raw=self.raw[:17]+_packLength(len(new))+new
 
 class Ports():
-	def __init__(self,start=0,end=1024,n=100):
+	'''Splits start-end into chunks of n ports.
+	order decides which ports go in which chunk:
+		seq:    start, start+1, ... (the default)
+		random: A seeded pseudo-random permutation (see Permutation)
+		stride: Chunk i gets start+i, start+i+stride, ... where stride is the number of chunks
+	Any port in skip is left out, and the orders apply to the ports that are left'''
+	def __init__(self,start=0,end=1024,n=100,order="seq",seed=0,skip=None):
 		self.start=start  #Inclusive
 		self.end=end  #Exclusive
 		self.n=n
-		self.pointer=start
+		self.order=order
+		self.space=range(start,end)  #Every port to hand out. Slicing a range gives a range
+		if skip:
+			skip=set(skip)
+			self.space=[p for p in self.space if p not in skip]
+		self.pointer=0  #Index into space
+		self.given=0  #Ports handed out so far
+		self.total=len(self.space)
+		if order=="random":
+			self.perm=Permutation(self.total,seed)
+		elif order=="stride":
+			self.stride=-(-self.total//n)  #Number of chunks
+			self.lane=0  #Next chunk
+		elif order!="seq":
+			raise PortOrderError(order)
 	def __iter__(self):
 		return self
 	def __next__(self):
-		'''Returns a list of next n ports'''
-		#Make sure n doesn't go past self.end
-		if self.pointer==self.end:
-			self.pointer=self.end+1
-			return b''
-		elif self.pointer>self.end:
+		'''Returns the next chunk of ports.
+		Returns an empty range once, after the last chunk'''
+		if self.given==self.total:
+			self.given+=1
+			return range(0)
+		elif self.given>self.total:
 			raise StopIteration
 
-		if self.pointer+self.n>self.end:
-			high=self.end
+		if self.order=="random":
+			toret=[self.space[next(self.perm)] for _ in range(min(self.n,self.total-self.given))]
+		elif self.order=="stride":
+			toret=self.space[self.lane::self.stride]
+			self.lane+=1
 		else:
-			high=self.pointer+self.n
-
-		toret=b''
-		for i in range(self.pointer,high):
-			toret+=iToB(i,2)
-		self.pointer=high
+			#Slicing stops at the end of space on its own
+			toret=self.space[self.pointer:self.pointer+self.n]
+			self.pointer+=self.n
+		self.given+=len(toret)
 		return toret
+
+class Permutation():
+	'''Iterates a seeded pseudo-random permutation of range(size) in O(1) memory.
+	A full period LCG (Hull-Dobell: c odd, a%4==1) walks every value below the next power of 2 once.
+	Each value goes through a bijective xorshift-multiply mix, and anything >=size is skipped'''
+	def __init__(self,size,seed=0):
+		self.size=size
+		bits=max(1,(size-1).bit_length())
+		self.mask=(1<<bits)-1
+		self.shift=max(1,bits//2)
+		rng=random.Random(seed)
+		self.a=(rng.getrandbits(bits)<<2|1)&self.mask
+		self.c=(rng.getrandbits(bits)|1)&self.mask
+		self.mul=rng.getrandbits(bits)|1
+		self.x=rng.getrandbits(bits)
+	def __iter__(self):
+		return self
+	def __next__(self):
+		while True:
+			self.x=(self.a*self.x+self.c)&self.mask
+			y=self.x^(self.x>>self.shift)
+			y=(y*self.mul)&self.mask
+			y^=y>>self.shift
+			if y<self.size:
+				return y
+
+class PortSet():
+	'''A set of ports stored as ranges.
+	Ports are only expanded when iterated'''
+	def __init__(self,ranges):
+		self.ranges=ranges  #List of range objects
+	def __iter__(self):
+		return itertools.chain.from_iterable(self.ranges)
+	def __len__(self):
+		return sum(len(r) for r in self.ranges)
+	def __str__(self):
+		return ','.join(f"{r.start}-{r.stop-1}" if len(r)>1 else str(r.start) for r in self.ranges)
+	def __repr__(self):
+		return self.__str__()
+
+def toRanges(ports):
+	'''Returns a sorted list of (start,end) pairs (end inclusive) covering ports'''
+	if type(ports)==range and ports.step==1:
+		return [(ports.start,ports.stop-1)] if ports else []
+	toret=[]
+	for p in sorted(ports):
+		if toret and p<=toret[-1][1]+1:
+			if p>toret[-1][1]:
+				toret[-1][1]=p
+		else:
+			toret.append([p,p])
+	return toret
+def encodePorts(ports,fmt=1):
+	'''Returns the payload of a port reply for ports.
+	An empty ports means there are no more ports'''
+	if fmt==0:
+		return iToB(len(ports),2)+b''.join([iToB(p,2) for p in ports])
+	if not ports:
+		return b'\x00'
+	ranges=toRanges(ports)
+	low=ranges[0][0]
+	high=ranges[-1][1]
+	sizes={1:3+4*len(ranges),
+		2:3+(high-low)//8+1,
+		3:1+2*len(ports)}
+	kind=min(sizes,key=sizes.get)
+	if kind==1:
+		return b'\x01'+struct.pack(f">H{len(ranges)*2}H",len(ranges),*itertools.chain.from_iterable(ranges))
+	elif kind==2:
+		bits=0
+		for r in ranges:
+			#Set every bit of the run at once
+			bits|=((1<<(r[1]-r[0]+1))-1)<<(high-r[1])
+		size=(high-low)//8+1
+		return b'\x02'+iToB(low,2)+(bits<<(size*8-(high-low+1))).to_bytes(size,"big")
+	return b'\x03'+struct.pack(f">{len(ports)}H",*ports)
+def decodePorts(payload,fmt=1):
+	'''Returns the ports in a port reply payload, or None if there are no more ports.
+	Compact replies become a PortSet, legacy replies a list'''
+	if fmt==0:
+		count=bToI(payload[0:2])
+		if not count:
+			return None
+		return list(struct.unpack(f">{count}H",payload[2:2+count*2]))
+	kind=payload[0]
+	if kind==0:
+		return None
+	elif kind==1:
+		count=bToI(payload[1:3])
+		bounds=struct.unpack(f">{count*2}H",payload[3:3+count*4])
+		return PortSet([range(bounds[i],bounds[i+1]+1) for i in range(0,len(bounds),2)])
+	elif kind==2:
+		base=bToI(payload[1:3])
+		ranges=[]
+		start=None
+		for i,byte in enumerate(payload[3:]):
+			#Skip whole bytes where nothing changes
+			if byte==0 and start==None or byte==0xff and start!=None:
+				continue
+			for b in range(8):
+				port=base+i*8+b
+				if byte&(0x80>>b):
+					if start==None:
+						start=port
+				elif start!=None:
+					ranges.append(range(start,port))
+					start=None
+		if start!=None:
+			ranges.append(range(start,base+(len(payload)-3)*8))
+		return PortSet(ranges)
+	elif kind==3:
+		return list(struct.unpack(f">{(len(payload)-1)//2}H",payload[1:]))
+	raise PortFormatError(kind)
+
 #------------#
 #    Data    #
 #------------#
@@ -219,14 +485,34 @@ class Ports():
 handshake_payload_types={0x00:("timeout",bToI),
 0x01:("port_start",bToI),
 0x02:("port_end",bToI),
-0x03:("port_chunk",bToI)}
+0x03:("port_chunk",bToI),
+0x04:("lockstep",bToI),
+0x05:("port_format",bToI),
+0x06:("port_order",lambda o:PORT_ORDERS[bToI(o)]),
+0x07:("port_seed",bToI),
+0x08:("port_skip",lambda p:decodePorts(p,1)),
+0x09:("port_directed",bToI),
+0x0a:("port_credit",bToI),
+0x0b:("fast",bToI),
+0x0c:("udp",bToI)}
 # 0x04:("delay",lambda d:bToI(p))}
 #Used by client to encode data.
 #Takes arguments from menuentries
 handshake_payload_client={"timeout":(b'\x00',iToB),
 "start":(b'\x01',iToB),
 "end":(b'\x02',iToB),
-"chunk":(b'\x03',iToB)}
+"chunk":(b'\x03',iToB),
+"lockstep":(b'\x04',lambda l:iToB(1 if l else 0)),
+"port_format":(b'\x05',iToB),
+"order":(b'\x06',lambda o:iToB(PORT_ORDERS.index(o))),
+"seed":(b'\x07',lambda s:iToB(s,4)),
+"skip":(b'\x08',lambda s:encodePorts(s,1)),
+"diff":(b'\x09',lambda d:iToB(1 if d else 0)),
+"credit":(b'\x0a',lambda c:iToB(c,2)),
+"ledger":(b'\x0b',iToB),
+"datagram":(b'\x0c',iToB)}
+PORT_FORMATS=(0,1)  #Port reply formats this version understands
+PORT_ORDERS=("seq","random","stride")  #Port orders, indexed by their handshake value
 
 #------------------#
 #    Misc Funcs    #
@@ -248,6 +534,10 @@ def recvUnit(s):
 		return toret
 	except socket.timeout:
 		return None
+def sendUnit(s,unit):
+	'''Send unit on the data channel s'''
+	metrics.SENT.inc(len(unit.raw))
+	return s.send(unit.raw)
 def recvFrom(s,b):
 	'''Receive b bytes from s'''
 	try:
@@ -257,21 +547,92 @@ def recvFrom(s,b):
 def recvExact(s,n):
 	'''Receive exactly n bytes from s via while loop.
 	Returns None if timeout'''
-	toret=b''
-	target=n
+	toret=bytearray(n)
+	view=memoryview(toret)
+	got=0
 	try:
-		while True:
-			toret+=s.recv(target)
-			if toret==b'':  #Remote closed
+		while got<n:
+			r=s.recv_into(view[got:],n-got)
+			if r==0:  #Remote closed
 				raise RecvError("Remote closed")
-			target=n-len(toret)
-			if target!=0:
-				continue
-			else:
-				return toret
+			got+=r
+		metrics.RECEIVED.inc(n)
+		return bytes(toret)
 	except socket.timeout:
 		return None
 
+class FrameReader():
+	'''Per-connection reader for a data channel.
+	Fills one preallocated buffer with recv_into and hands out complete units from it,
+	so a single recv can hold several (or partial) units.
+	The unread region [start:end) is moved back to the front once the tail is too small for a full frame'''
+	MAX_FRAME=19+0xffff  #Header + length + biggest payload
+	def __init__(self,s,size=1<<18):
+		self.s=s
+		self.buf=bytearray(max(size,self.MAX_FRAME*2))
+		self.view=memoryview(self.buf)
+		self.start=0  #First unread byte
+		self.end=0  #One past the last received byte
+		self.closed=False
+		self.bytes=0  #Total bytes received
+	def __iter__(self):
+		'''Yields units until the remote closes'''
+		while True:
+			unit=self.recvUnit()
+			if unit==None:
+				if self.closed:
+					return
+				continue
+			yield unit
+	def _frameLen(self):
+		'''Returns the length of the next buffered frame if it's complete, None otherwise'''
+		have=self.end-self.start
+		if have<17:
+			return None
+		if not self.buf[self.start]>>2&0b1:  #No payload
+			return 17
+		if have<19:
+			return None
+		n=19+LENGTH.unpack_from(self.buf,self.start+17)[0]
+		return n if have>=n else None
+	def _fill(self):
+		'''Receive as much as fits into the free tail of the buffer.
+		Returns the number of bytes received'''
+		if self.start==self.end:
+			self.start=self.end=0
+		elif len(self.buf)-self.end<self.MAX_FRAME:
+			#Compact: move the partial frame to the front
+			left=self.end-self.start
+			self.buf[:left]=self.view[self.start:self.end]
+			self.start=0
+			self.end=left
+		r=self.s.recv_into(self.view[self.end:])
+		if r==0:
+			self.closed=True
+		self.end+=r
+		self.bytes+=r
+		metrics.RECEIVED.inc(r)
+		return r
+	def pending(self):
+		'''Returns True if a complete unit is already buffered'''
+		return self._frameLen()!=None
+	def recvUnit(self):
+		'''Returns the next unit.
+		Returns None if s timedout or the remote closed'''
+		try:
+			while True:
+				n=self._frameLen()
+				if n!=None:
+					break
+				if self.closed or not self._fill():
+					return None
+		except socket.timeout:
+			return None
+		who_byte,key=unpackHeader(self.buf,self.start)
+		payload=bytes(self.view[self.start+19:self.start+n]) if n>17 else None
+		self.start+=n
+		return Unit.fromHeader(who_byte,key,payload)
+
 
 #--------------#
 #    Errors    #
@@ -284,6 +645,14 @@ class HandshakeError(Exception):
 class NotInfoError(Exception):
 	def __init__(self):
 		super().__init__("Unit isn't informational!")
+class PortOrderError(Exception):
+	def __init__(self,order):
+		super().__init__(f"Unknown port order: {order}")
+		self.order=order
+class PortFormatError(Exception):
+	def __init__(self,kind):
+		super().__init__(f"Unknown port reply encoding: {kind}")
+		self.kind=kind
 class RecvError(Exception):
 	def __init__(self,message):
 		super().__init__(f"Error receiving bytes: {message}")
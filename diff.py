@@ -0,0 +1,121 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Differential rescans against a cached baseline
+## Notes:
+##  - A baseline is the result of every port from the last --diff run, saved as a journal (see journal.py)
+##    under CACHE_DIR, keyed by the server, port range, and the options that change how ports are classified
+##  - Ports are probed in priority order:
+##      1. Ports without a baseline, and ports next to a different result (the edges of each run of results)
+##      2. Neighbours of any port found to have changed, so a changed run is followed to its ends
+##      3. A seeded random sample of the ports inside runs (stable ports)
+##  - Stops once NEED stable ports in a row came back unchanged. If more than MISS of the stable ports had changed,
+##    that many clean samples in a row would happen less than ALPHA of the time
+##  - Ports that were never probed keep their baseline result
+import os,hashlib,random,collections
+from math import ceil,log
+import journal,results
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+CACHE_DIR=os.path.join(os.environ.get("XDG_CACHE_HOME",os.path.expanduser("~/.cache")),"dropdetect")
+MISS=0.01
+ALPHA=0.05
+NEED=ceil(log(ALPHA)/log(1-MISS))
+
+def cachePath(ip,port,start,end,timeout,lockstep=True):
+	'''Returns the baseline file for a scan'''
+	key=f"{ip}:{port}:{start}-{end}:t{timeout}:l{int(bool(lockstep))}"
+	return os.path.join(CACHE_DIR,hashlib.sha1(key.encode()).hexdigest()[:16]+".ddj")
+def loadBaseline(path):
+	'''Returns the baseline at path as a results.ResultStore, or None if there isn't one'''
+	if not os.path.isfile(path):
+		return None
+	store=results.ResultStore()
+	try:
+		journal.Journal.resume(path,store).close()
+	except journal.JournalError:
+		return None
+	return store
+def saveBaseline(path,store,start,end):
+	'''Saves every result in start-end as the new baseline.
+	Written to a temporary file first, so a crash never leaves half a baseline'''
+	os.makedirs(os.path.dirname(path),exist_ok=True)
+	j=journal.Journal(path+".tmp",start,end,batch=1<<16)
+	for p in store.done(start,end):
+		j.append(p,store.get(p),store.getLatency(p))
+	j.close()
+	os.replace(path+".tmp",path)
+def merge(baseline,store,start,end):
+	'''Fills every port store doesn't have a result for with its baseline result'''
+	for p in baseline.done(start,end):
+		if store.get(p)==None:
+			store.set(p,baseline.get(p),baseline.getLatency(p))
+
+def transitions(baseline,store,start,end):
+	'''Returns [(first,last,old,new)], every run of ports whose result changed from baseline, in order'''
+	toret=[]
+	for p in range(start,end):
+		old=baseline.get(p)
+		new=store.get(p)
+		if old==None or new==None or old==new:
+			continue
+		if toret and toret[-1][1]==p-1 and toret[-1][2:]==(old,new):
+			toret[-1]=(toret[-1][0],p,old,new)
+		else:
+			toret.append((p,p,old,new))
+	return toret
+
+class Planner():
+	'''Decides which ports to probe next, and when to stop'''
+	def __init__(self,baseline,start,end,seed=0):
+		self.baseline=baseline
+		self.start=start
+		self.end=end
+		self.urgent=collections.deque()  #Probed before any stable port
+		self.stable=[]
+		for p in range(start,end):
+			old=baseline.get(p)
+			if old==None\
+				or p>start and baseline.get(p-1)!=old\
+				or p+1<end and baseline.get(p+1)!=old:
+				self.urgent.append(p)
+			else:
+				self.stable.append(p)
+		random.Random(seed).shuffle(self.stable)
+		self.given=set()  #Ports handed out so far
+		self.sampled=set()  #Stable ports handed out, but not recorded yet
+		self.quiet=0  #Stable ports in a row that didn't change
+		self.changed=0
+	def next(self,n):
+		'''Returns up to n ports to probe next.
+		Returns an empty list once done'''
+		toret=[]
+		while len(toret)<n and self.urgent:
+			p=self.urgent.popleft()
+			if p not in self.given:
+				toret.append(p)
+		while len(toret)<n and self.stable and not self.confident():
+			p=self.stable.pop()
+			if p not in self.given:
+				toret.append(p)
+				self.sampled.add(p)
+		self.given.update(toret)
+		return toret
+	def record(self,ports,store):
+		'''Feed the results (from store) of ports handed out by next'''
+		for p in ports:
+			old=self.baseline.get(p)
+			new=store.get(p)
+			if old!=None and new!=None and old!=new:
+				self.changed+=1
+				self.quiet=0
+				#Follow the change both ways
+				for q in (p-1,p+1):
+					if self.start<=q<self.end and q not in self.given:
+						self.urgent.append(q)
+			elif p in self.sampled:
+				self.quiet+=1
+			self.sampled.discard(p)
+	def confident(self):
+		'''True once enough stable ports in a row came back unchanged'''
+		return self.quiet>=NEED
@@ -10,7 +10,7 @@ from progmenu import MENU
 from misc import iToB,bToI
 from math import ceil
 import time,threading,sys,os
-import grid,server,client,data,globe
+import grid,server,client,data,globe,asyncscan,rtt,shard,daemon,journal,diff,results,stream,report,metrics,profiling,ledger,pacer
 import menuentries
 
 try:
@@ -21,48 +21,74 @@ except KeyboardInterrupt:
 
 MY_NAME=__file__[__file__.rfind('/')+1:-3]
 S=7
-screen=grid.Grid(4,5,grid.Unit(S),draw=False)
+screen=grid.Headless() if PARSER["headless"] else grid.Grid(4,5,grid.Unit(S),draw=False)
 
 def main():
+	#Expose metrics, for watching long scans (and the daemon)
+	if PARSER["metrics"]:
+		try:
+			metrics.expose(PARSER["metrics"])
+		except OSError as e:
+			print(f"[|X:{MY_NAME}]: Can't expose metrics on {PARSER['metrics']}: {e}")
+			return 1
+		globe.results.listen(metrics.record)
 	#Determine if client or server
 	if PARSER["server"]:
 		print(f"[|X:{MY_NAME}]: Running as server...")
+		if PARSER["daemon"]:
+			try:
+				daemon.Daemon(PARSER["ip"],PARSER["port"]).run()
+			except KeyboardInterrupt:
+				pass
+			return None
 		#Do handshake
 		try:
-			serv,cli,info_dict=server.doHandshake(PARSER["ip"],PARSER["port"])
+			handshake=server.doHandshake(PARSER["ip"],PARSER["port"])
 		except PermissionError:
 			return 1
+		if handshake==None:  #Client sent something we can't use
+			return 1
+		serv,cli,info_dict=handshake
 		#Start main loop
 		# print(f"[|X:{MY_NAME}]: Starting main loop...")
-		thread_list=[]
-		for p in data.Ports(info_dict["port_start"],info_dict["port_end"],info_dict["port_chunk"]):
-			#Wait for client port request
-			recv=data.recvUnit(cli)
-			if not recv.status or recv.content!=2:
-				print(f"[|X:{MY_NAME}]: Non/bad port request from client")
-				unit=data.Unit(b'\xc4'+info_dict["main_id"])
-				unit.setPayload(b"BAD_PORT_REQUEST")
-				#Close
-				cli.close()
-				serv.close()
-				return None
-			#Send next ports
-			print(f"[|X:{MY_NAME}]: Sending: {p}")
-			unit=data.Unit(b'\xbc'+info_dict["main_id"])
-			unit.setPayload(iToB(len(p)//2,2)+p)
-			cli.send(unit.raw)
-			#Spawn threads
-			thread_list.append(threading.Thread(target=server.minion_thread,
-			args=(PARSER["ip"],
-				p,
-				info_dict["timeout"])))
-			thread_list[-1].start()
-		#Join threads
-		for t in thread_list:
-			t.join()
+		done=server.serveSession(cli,info_dict,PARSER["ip"],PARSER["pool"])
+		serv.close()
+		if not done:
+			return None
 		print(f"[|X:{MY_NAME}]: Done!")
 	else:
+		#Journal results as they come in, picking up where an earlier scan stopped if asked to
+		jrnl=None
+		if PARSER["resume"]:
+			try:
+				jrnl=journal.Journal.resume(PARSER["resume"],globe.results)
+			except (OSError,journal.JournalError) as e:
+				print(f"[|X:{MY_NAME}]: Can't resume: {e}")
+				return 1
+			PARSER["start"],PARSER["end"]=jrnl.start,jrnl.end
+			PARSER["skip"]=globe.results.done(jrnl.start,jrnl.end)  #Sent in the handshake
+		elif PARSER["journal"]:
+			jrnl=journal.Journal(PARSER["journal"],PARSER["start"],PARSER["end"])
+		if jrnl:
+			globe.results.listen(jrnl.append)
+		#Stream results as they come in (always, when headless)
+		out=None
+		if PARSER["stream"] or PARSER["headless"]:
+			out=stream.JsonlWriter.open(PARSER["stream"] or "-")
+			globe.results.listen(out.append)
 		total=PARSER["end"]-PARSER["start"]
+		left=total-len(PARSER.get("skip",()))
+		#Only probe what probably changed since the last --diff run
+		planner=None
+		if PARSER["diff"]:
+			PARSER["lockstep"]=True  #Each chunk's results decide the next chunk, and false CLOSEs would look like changes
+			baseline_path=diff.cachePath(PARSER["ip"],PARSER["port"],PARSER["start"],PARSER["end"],PARSER["timeout"])
+			baseline=diff.loadBaseline(baseline_path) or results.ResultStore(latency=False)
+			planner=diff.Planner(baseline,PARSER["start"],PARSER["end"],PARSER["seed"])
+		#The async engine (and every --procs worker) connects to a whole chunk at once,
+		#and without lock-step the server listens on one port at a time
+		if PARSER["engine"]=="async" or PARSER["procs"]:
+			PARSER["lockstep"]=True
 		#Draw grid
 		screen.enterGrid()
 		screen.goTo()
@@ -79,7 +105,11 @@ def main():
 		screen.drawUnit(grid.Unit(S,'\033[44m',"Procs:"))
 		screen.write("0")
 		screen.write("of")
-		screen.write(ceil(total/PARSER["chunk"]))
+		screen.write(ceil(left/PARSER["chunk"]))
+		#From here on, scan threads only touch counters. This thread draws them 10 times a second
+		screen.render(10,lambda:client.drawSums(screen))
+		if left<total:
+			screen.notify(f"Resumed {total-left} ports from {PARSER['resume']}")
 
 		#This doesn't actually help that much!
 		#I'll have to get the server to check it's permissions instead
@@ -92,6 +122,35 @@ def main():
 		# 	screen.getLeave()
 		# 	return 1
 
+		#Probe UDP ports. The server echoes probes from windows, so lock-step is a must
+		if PARSER["udp"]:
+			for opt in ("fast","procs","diff"):
+				if PARSER[opt]:
+					screen.notify(f"--udp doesn't work with --{opt} yet",colour='\033[41m')
+					screen.getLeave()
+					return 1
+			PARSER["lockstep"]=True
+			PARSER["datagram"]=1  #Sent in the handshake
+		#Let the server send port replies ahead of our requests (not with lock-step: one window at a time)
+		credit=0 if PARSER["lockstep"] else PARSER["prefetch"]
+		if credit:
+			PARSER["credit"]=credit  #Sent in the handshake
+		#Connect-only probes, checked against the server's accept ledger at the end
+		if PARSER["fast"]:
+			if PARSER["procs"]:
+				screen.notify("--fast doesn't work with --procs yet",colour='\033[41m')
+				screen.getLeave()
+				return 1
+			globe.ledger=ledger.Ledger()
+			globe.results.hold()  #Until the ledger confirms them, ACCEPTs aren't streamed or journaled
+			PARSER["ledger"]=1  #Sent in the handshake
+		#Rate limit probes. One scheduler hands out send slots to every worker
+		if PARSER["pace_by"] and not PARSER["pace"]:
+			screen.notify("--pace-by needs --pace",colour='\033[41m')
+			screen.getLeave()
+			return 1
+		if PARSER["pace"]:
+			globe.pacer=pacer.Pacer(*PARSER["pace"],*(PARSER["pace_by"] or ()))
 		#Assemble args into a dict.
 		#Each key+value must be a byte
 		info_dict={}  #Any defaults are set by menuentries
@@ -101,12 +160,17 @@ def main():
 				info_dict[a[1][0]]=a[1][1](PARSER[a[0]])
 			except KeyError:
 				continue
+		#Adaptive timeouts/delays/concurrency, if asked for
+		ctl=rtt.Controller(PARSER["timeout"],PARSER["delay"],PARSER["concurrency"]) if PARSER["adaptive"] else None
 		#Do handshake
+		main_id=os.urandom(16)  #Unique, so a daemon can tell clients apart
 		try:
 			screen.notify("Starting handshake...")
 			cli=client.doHandshake(PARSER["ip"],
 			PARSER["port"],
-			info_dict)
+			info_dict,
+			main_id,
+			ctl)
 		except ConnectionRefusedError:
 			screen.notify("Couldn't connect to server!",colour='\033[41m')
 			screen.getLeave()
@@ -124,69 +188,157 @@ def main():
 			screen.notify(f"Couldn't complete handshake!",colour='\033[41m')
 			return 1
 		#Start thread-spawning loop
-		main_id=b'______main______'
+		reader=data.FrameReader(cli)
 		full_list={"close":[],"drop":[],"srverr":[]}  #List of dropped/closed ports
-		sums={"accept":0,"close":0,"drop":0,"srverr":0}
 		thread_list=[]
+		if PARSER["procs"]:
+			engine=shard.ShardPool(PARSER["procs"],
+				PARSER["concurrency"],
+				PARSER["engine"],
+				(PARSER["timeout"],PARSER["delay"]) if PARSER["adaptive"] else None)
+		elif PARSER["engine"]=="async" and not PARSER["udp"]:
+			engine=asyncscan.Engine(PARSER["concurrency"],ctl)
+		else:
+			engine=None
 		screen.notify("Starting main loop")
-		while True:
-			#Make port request
-			unit=data.Unit(b'\x28'+main_id)
-			cli.send(unit.raw)
-			#Get port reply
-			recv=data.recvUnit(cli)
-			if not recv.status or recv.content!=3:
-				screen.notify(f"Bad port response from server!",colour='\033[41m')
-				if recv.content==4 and recv.hasPayload:
-					screen.nnotify(recv.payload.decode())
-				cli.close()
-				return None
-			elif recv.payload[0:2]==b'\x00\x00':
-				break
-			#Extract ports from server message
-			port_list=[]
-			for p in range(0,bToI(recv.payload[0:2])*2,2):
-				port_list.append(bToI(recv.payload[p+2:p+4]))
-			#Spawn thread to connect to ports
-			thread_list.append(threading.Thread(target=client.minion_thread,
-				args=(PARSER["ip"],
-					port_list,
-					bToI(info_dict[b'\x00']),
-					PARSER["delay"],
-					screen,
-					sums)))
-			thread_list[-1].start()
-			globe.LOCK.acquire()
-			globe.thread_count+=1
-			screen.goTo(1,4)
-			screen.write(globe.thread_count)
-			globe.LOCK.release()
-			# screen.nnotify(f"Started thread #{len(thread_list)} ({port_list[0]}-{port_list[-1]})")
-		screen.notify("Done asking for ports!")
-		#Wait for all threads...
-		weight=total/PARSER["chunk"]
-		done_threads=0
-		for t in thread_list:
-			t.join()
+		finished=False
+		try:
+			while True:
+				#Make port request. With credits, the server already sent this reply
+				if planner:  #Ask for the ports we want (none once it's confident)
+					unit=data.Unit(b'\x2c'+main_id)
+					unit.setPayload(data.encodePorts(planner.next(PARSER["chunk"])))
+					data.sendUnit(cli,unit)
+				elif not credit:
+					data.sendUnit(cli,data.Unit(b'\x28'+main_id))
+				#Get port reply
+				recv=ledger.recvUnit(reader,globe.ledger)
+				if not recv or not recv.status or recv.content!=3:
+					screen.notify(f"Bad port response from server!",colour='\033[41m')
+					if recv and recv.content==4 and recv.hasPayload:
+						screen.nnotify(recv.payload.decode())
+					cli.close()
+					return None
+				#Extract ports from server message
+				port_list=data.decodePorts(recv.payload,PARSER["port_format"])
+				if port_list==None:  #No more ports
+					break
+				if credit:  #Give the credit back, so the server sends another reply while we probe this one
+					data.sendUnit(cli,data.Unit(b'\x28'+main_id))
+				if PARSER["lockstep"]:
+					#Wait for the server to listen on this window.
+					#A daemon may have to wait for other clients to free these ports first, so only give up if it hung up
+					recv=ledger.recvUnit(reader,globe.ledger)
+					while recv==None and not reader.closed:
+						recv=ledger.recvUnit(reader,globe.ledger)
+					if not recv or not recv.status or recv.content!=6:
+						screen.notify(f"Bad window from server!",colour='\033[41m')
+						cli.close()
+						return None
+					globe.thread_count+=1
+					#The server is already listening, so a refused port really is closed: no retries
+					if PARSER["udp"]:
+						client.udp_thread(PARSER["ip"],port_list,bToI(info_dict[b'\x00']),screen,ctl)
+					elif engine:
+						engine.minion(PARSER["ip"],port_list,bToI(info_dict[b'\x00']),0,screen,1).result()
+					elif PARSER["engine"]=="epoll":
+						client.epoll_thread(PARSER["ip"],port_list,bToI(info_dict[b'\x00']),screen,ctl)
+					else:
+						client.minion_thread(PARSER["ip"],port_list,bToI(info_dict[b'\x00']),0,screen,1,ctl)
+					#Tell the server we're done with this window
+					unit=data.Unit(b'\xec'+main_id)
+					unit.setPayload(recv.payload)
+					data.sendUnit(cli,unit)
+					if planner:
+						planner.record(port_list,globe.results)
+					continue
+				#Spawn thread (or schedule on the event loop) to connect to ports
+				if engine:
+					engine.minion(PARSER["ip"],
+						port_list,
+						bToI(info_dict[b'\x00']),
+						PARSER["delay"],
+						screen)
+				elif PARSER["engine"]=="epoll":
+					thread_list.append(threading.Thread(target=profiling.wrap(client.epoll_thread),
+						args=(PARSER["ip"],
+							port_list,
+							bToI(info_dict[b'\x00']),
+							screen,
+							ctl)))
+					thread_list[-1].start()
+				else:
+					thread_list.append(threading.Thread(target=profiling.wrap(client.minion_thread),
+						args=(PARSER["ip"],
+							port_list,
+							bToI(info_dict[b'\x00']),
+							PARSER["delay"],
+							screen,
+							3,
+							ctl)))
+					thread_list[-1].start()
+				with globe.LOCK:
+					globe.thread_count+=1
+				# screen.nnotify(f"Started thread #{len(thread_list)} ({port_list[0]}-{port_list[-1]})")
+			screen.notify("Done asking for ports!")
+			#Wait for all threads...
+			weight=total/PARSER["chunk"]
+			done_threads=0
+			for t in thread_list:
+				t.join()
+			if engine:
+				engine.join()
+			if globe.pacer:
+				globe.pacer.close()
+			if globe.ledger:
+				#Get the rest of the ledger. Any ACCEPT the server never saw was something else answering
+				while not globe.ledger.done and not reader.closed:
+					ledger.recvUnit(reader,globe.ledger)
+				if globe.ledger.done:
+					for p in [p for p in globe.ledger.probed if globe.results.get(p)==0 and not globe.ledger.confirms(p)]:
+						globe.results.set(p,3,globe.results.getLatency(p),globe.results.attempts[p] or None)
+				else:
+					screen.notify("The server never finished its accept ledger! ACCEPTs are unconfirmed",colour='\033[41m')
+			finished=True
+		finally:
+			if not finished and globe.results.held:  #Stopped before the ledger came in (bad reply, Ctrl-C, ...)
+				screen.notify("Stopped before the server finished its accept ledger! ACCEPTs are unconfirmed",colour='\033[41m')
+			globe.results.release()  #Every other ACCEPT, announced once (no-op without --fast)
+		if jrnl:
+			jrnl.close()
+		if out:
+			out.close()
 
-		#Print results
-		screen.notify("Results:")
-		thresh=total//4  #Highest a sum can be (inclusive)
-		for r in sums.items():  #sums is a dict; Ex: {"accept":20}; 20 accepted packets
-			globe.all_lists[r[0]].sort()  #Sort all lists because we might save them later
-			if 0<r[1]<=thresh:
-				screen.nnotify(f"{r[0]}: {globe.all_lists[r[0]]}")
+		if planner:
+			#Print only what changed, then keep everything as the next baseline
+			changes=diff.transitions(baseline,globe.results,PARSER["start"],PARSER["end"])
+			screen.notify(f"Changes since baseline ({len(planner.given)}/{left} ports probed):")
+			if not baseline.scanned():
+				screen.nnotify("  No baseline yet, saving this scan as one")
+			elif not changes:
+				screen.nnotify("  None")
+			for first,last,old,new in changes:
+				screen.nnotify(f"  {first}-{last}: {globe.RESULT_NAMES[old]}->{globe.RESULT_NAMES[new]}" if first!=last\
+					else f"  {first}: {globe.RESULT_NAMES[old]}->{globe.RESULT_NAMES[new]}")
+			diff.merge(baseline,globe.results,PARSER["start"],PARSER["end"])
+			diff.saveBaseline(baseline_path,globe.results,PARSER["start"],PARSER["end"])
+		else:
+			#Print results
+			screen.notify("Results:")
+			thresh=total//4  #Highest a sum can be (inclusive)
+			for i,count in enumerate(globe.results.sums().values()):  #Ex: {"accept":20}; 20 accepted packets
+				if 0<count<=thresh:
+					screen.nnotify(f"{globe.RESULT_NAMES[i]}: {list(globe.results.ports(i))}")
 		#Save results if option is set
 		if PARSER["outfile"]:
-			with open(PARSER["outfile"],'w') as f:
-				f.write(f"""__--++* DropDetect Report *++--__\n
-Port range: {PARSER["start"]} - {PARSER["end"]}\n\n""")
-				for r in globe.all_lists.items():
-					# screen.nnotify(f"""{r[0]}: {r[1]}""")
-					f.write(f"{r[0]}: {', '.join([str(i) for i in r[1]])}\n")
+			report.write(PARSER["outfile"],PARSER["format"],globe.results,PARSER["start"],PARSER["end"])
 			screen.nnotify(f"Saved output to {PARSER['outfile']}!")
 
+		if PARSER["headless"]:
+			screen.notify("Done!")
+			return None
 		screen.nnotify("Done! Press [Enter] to finish",colour='\033[42m')
+		screen.flush()
 		input()
 		screen.exitGrid()
 
@@ -197,8 +349,16 @@ def err(text,flush=True):
 		sys.stderr.flush()
 
 if __name__=="__main__":
+	profiler=None
+	if PARSER["profile"]:
+		profiler=profiling.Profiler(PARSER["profile"])
+		profiler.start()
 	try:
 		main()
 	except KeyboardInterrupt:
 		screen.exitGrid()
 		print('\r\033[K',end='')
+	finally:
+		screen.flush()  #Anything the renderer hasn't drawn yet
+		if profiler:
+			profiler.stop()
@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Userspace firewall simulator, for testing on one box
+## Notes:
+##  - Linux only. Sits between client and server as a TCP relay:
+##    it listens on the same ports as the server, on another address (ex. 127.0.0.2), and the client scans that address.
+##    Neither the client nor the server know it's there
+##  - Rules are per port range, first match wins. Ports without a rule aren't listened on at all (reject).
+##    The data port needs a rule too (normally accept)
+##      accept:  Relay the connection to the server
+##      reject:  Nothing listens, so the kernel answers the SYN with a RST (CLOSE)
+##      drop:    Listen, with a socket filter (classic BPF, "ret #0") that drops every packet, SYNs included (DROP)
+##      delay=N: Relay, but only start N ms after the connection comes in
+##      rate=N:  Relay at most N new connections a second for the whole rule, using a token bucket.
+##               When it runs out, the rule's ports get the drop filter until there's a token again.
+##               Connections that already made it into the accept queue are still relayed
+##  - Everything runs on one selector, in one thread
+import socket,selectors,errno,heapq,struct,time,sys,ctypes
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+ACTIONS=("accept","reject","drop","delay","rate")
+BUFSIZE=1<<16
+SO_ATTACH_FILTER=getattr(socket,"SO_ATTACH_FILTER",26)
+SO_DETACH_FILTER=getattr(socket,"SO_DETACH_FILTER",27)
+_DROP_ALL=ctypes.create_string_buffer(struct.pack("HBBI",0x06,0,0,0))  #BPF_RET|BPF_K, k=0: keep 0 bytes
+DROP_FILTER=struct.pack("HP",1,ctypes.addressof(_DROP_ALL))  #struct sock_fprog
+
+def parseRules(specs):
+	'''Parses rules like "20000-20099:drop", "8080:accept", or "20200-20299:delay=500".
+	Returns [Rule]'''
+	toret=[]
+	for spec in specs:
+		ports,_,action=spec.partition(':')
+		action,_,arg=action.partition('=')
+		first,_,last=ports.partition('-')
+		if action not in ACTIONS or (action in ("delay","rate"))!=bool(arg):
+			raise RuleError(spec)
+		try:
+			toret.append(Rule(int(first),int(last or first),action,float(arg) if arg else None))
+		except ValueError:
+			raise RuleError(spec)
+	return toret
+
+class Rule():
+	def __init__(self,first,last,action,arg=None):
+		self.first=first  #Inclusive
+		self.last=last  #Inclusive
+		self.action=action
+		self.arg=arg
+		#Token bucket (rate only), holding up to one second of connections
+		self.tokens=arg
+		self.refilled=time.monotonic()
+		self.listeners=[]
+		self.paused=False
+	def __contains__(self,port):
+		return self.first<=port<=self.last
+	def __str__(self):
+		return f"{self.first}-{self.last}:{self.action}{'' if self.arg==None else f'={self.arg:g}'}"
+	def take(self):
+		'''Takes a token if there is one (rate only)'''
+		now=time.monotonic()
+		self.tokens=min(self.arg,self.tokens+(now-self.refilled)*self.arg)
+		self.refilled=now
+		if self.tokens<1:
+			return False
+		self.tokens-=1
+		return True
+
+class Firewall():
+	def __init__(self,addr,upstream,rules):
+		'''Listens on addr, and relays to the same port on upstream'''
+		self.addr=addr
+		self.upstream=upstream
+		self.rules=rules
+		self.sel=selectors.DefaultSelector()
+		self.listeners={}  #{port:socket}
+		self.timers=[]  #Heap of (when,n,func,args)
+		self.n=0  #Tie breaker for timers
+		self.stats={a:0 for a in ACTIONS}  #Connections per action
+
+	def open(self):
+		'''Listen on every port with a rule (other than reject)'''
+		taken=set()
+		for r in self.rules:
+			for p in range(r.first,r.last+1):
+				if p in taken:  #An earlier rule has it
+					continue
+				taken.add(p)
+				if r.action=="reject":
+					continue
+				s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+				s.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+				s.bind((self.addr,p))
+				s.listen(128)
+				s.setblocking(False)
+				self.listeners[p]=s
+				if r.action=="drop":
+					s.setsockopt(socket.SOL_SOCKET,SO_ATTACH_FILTER,DROP_FILTER)
+					continue
+				r.listeners.append(s)
+				self.sel.register(s,selectors.EVENT_READ,(self._accept,(p,r)))
+		print(f"[|X:{MY_NAME}:open]: Listening on {len(self.listeners)} ports of {self.addr}, relaying to {self.upstream}")
+	def run(self):
+		'''Relay forever'''
+		while True:
+			wait=max(0,self.timers[0][0]-time.monotonic()) if self.timers else None
+			for key,ev in self.sel.select(wait):
+				func,args=key.data
+				func(key.fileobj,ev,*args)
+			now=time.monotonic()
+			while self.timers and self.timers[0][0]<=now:
+				_,_,func,args=heapq.heappop(self.timers)
+				func(*args)
+	def later(self,delay,func,*args):
+		'''Runs func(*args) from the loop in delay seconds'''
+		self.n+=1
+		heapq.heappush(self.timers,(time.monotonic()+delay,self.n,func,args))
+	def close(self):
+		for s in self.listeners.values():
+			s.close()
+		for key in list(self.sel.get_map().values()):
+			key.fileobj.close()
+		self.sel.close()
+
+	def _accept(self,server,ev,port,r):
+		try:
+			cli,_=server.accept()
+		except BlockingIOError:
+			return
+		if r.action=="rate" and not r.take():
+			#Out of tokens: drop new SYNs until there's one again
+			self._pause(r)
+		cli.setblocking(False)
+		self.stats[r.action]+=1
+		if r.action=="delay":
+			self.later(r.arg/1000,self._connect,cli,port)
+		else:
+			self._connect(cli,port)
+	def _pause(self,r):
+		if r.paused:
+			return
+		r.paused=True
+		for s in r.listeners:
+			s.setsockopt(socket.SOL_SOCKET,SO_ATTACH_FILTER,DROP_FILTER)
+		self.later((1-r.tokens)/r.arg,self._resume,r)
+	def _resume(self,r):
+		r.paused=False
+		for s in r.listeners:
+			s.setsockopt(socket.SOL_SOCKET,SO_DETACH_FILTER,0)
+	def _connect(self,cli,port):
+		'''Connect to the server, then pipe both ways'''
+		up=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		up.setblocking(False)
+		err=up.connect_ex((self.upstream,port))
+		if err not in (0,errno.EINPROGRESS):
+			up.close()
+			_reset(cli)
+			return
+		a=Pipe(cli)
+		b=Pipe(up,connecting=True)
+		a.peer,b.peer=b,a
+		self.sel.register(cli,selectors.EVENT_READ,(self._pipe,(a,)))
+		self.sel.register(up,selectors.EVENT_WRITE,(self._pipe,(b,)))
+	def _pipe(self,s,ev,p):
+		'''Moves data for one side of a relayed connection'''
+		q=p.peer
+		if p.connecting:
+			if s.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR):  #The server isn't listening: pass it on as a RST
+				self._drop(p,reset=q)
+				return
+			p.connecting=False
+		if ev&selectors.EVENT_READ:
+			try:
+				data=s.recv(BUFSIZE)
+			except (BlockingIOError,InterruptedError):
+				data=None
+			except OSError:
+				data=b''
+			if data==b'':
+				p.eof=True
+			elif data:
+				q.out+=data
+		#Send whatever either side has waiting
+		for side in (p,q):
+			if side.out and not side.connecting:
+				try:
+					del side.out[:side.sock.send(side.out)]
+				except (BlockingIOError,InterruptedError):
+					pass
+				except OSError:
+					self._drop(p)
+					return
+		#Once either side hangs up and everything it sent is delivered, hang up the other
+		if (p.eof or q.eof) and not p.out and not q.out:
+			self._drop(p)
+			return
+		self._watch(p)
+		self._watch(q)
+	def _watch(self,p):
+		'''Updates what the selector waits for on p'''
+		ev=(0 if p.eof else selectors.EVENT_READ)|(selectors.EVENT_WRITE if p.out or p.connecting else 0)
+		if ev==p.events:
+			return
+		if not ev:
+			self.sel.unregister(p.sock)
+		elif not p.events:
+			self.sel.register(p.sock,ev,(self._pipe,(p,)))
+		else:
+			self.sel.modify(p.sock,ev,(self._pipe,(p,)))
+		p.events=ev
+	def _drop(self,p,reset=None):
+		'''Closes both sides of a relayed connection (reset's with a RST)'''
+		for side in (p,p.peer):
+			if side.events:
+				self.sel.unregister(side.sock)
+				side.events=0
+			if side is reset:
+				_reset(side.sock)
+			else:
+				side.sock.close()
+
+class Pipe():
+	'''One side of a relayed connection'''
+	def __init__(self,sock,connecting=False):
+		self.sock=sock
+		self.connecting=connecting
+		self.out=bytearray()  #Waiting to be sent on sock
+		self.eof=False  #sock won't send anything else
+		self.peer=None
+		self.events=selectors.EVENT_WRITE if connecting else selectors.EVENT_READ
+
+def _reset(s):
+	'''Closes s with a RST instead of a FIN'''
+	s.setsockopt(socket.SOL_SOCKET,socket.SO_LINGER,struct.pack("ii",1,0))
+	s.close()
+
+class RuleError(Exception):
+	def __init__(self,spec):
+		super().__init__(f"Bad rule: {spec} (expected <port>[-<port>]:<{'|'.join(ACTIONS)}>[=<n>])")
+		self.spec=spec
+
+if __name__=="__main__":
+	#Ex: python firewall.py 127.0.0.2 127.0.0.1 8080:accept 20000-20099:accept 20100-20199:drop 20200-20299:delay=500
+	if len(sys.argv)<4:
+		print(f"Usage: {sys.argv[0]} <listen ip> <server ip> <rule> [<rule>...]")
+		print(f"  Rules: <port>[-<port>]:<action>, actions: accept, reject, drop, delay=<ms>, rate=<connections/s>")
+		exit(1)
+	try:
+		fw=Firewall(sys.argv[1],sys.argv[2],parseRules(sys.argv[3:]))
+	except RuleError as e:
+		print(f"[|X:{MY_NAME}]: {e}")
+		exit(1)
+	for r in fw.rules:
+		print(f"[|X:{MY_NAME}]: {r}")
+	fw.open()
+	try:
+		fw.run()
+	except KeyboardInterrupt:
+		print(f"\r[|X:{MY_NAME}]: Connections: {fw.stats}")
+	finally:
+		fw.close()
@@ -3,13 +3,14 @@
 ## Date:    2021.12.23
 ## Description:    Holds global resources
 import threading
+import results as _results
 
 LOCK=threading.Lock()
 thread_count=0
-all_lists={"accept":[],
-"close":[],
-"drop":[],
-"srverr":[]}
+results=_results.ResultStore()  #Result of every port, written by the scan workers
+RESULT_NAMES=_results.NAMES  #Indexed by tryPort's return value
+ledger=None  #ledger.Ledger in fast mode (--fast), None otherwise
+pacer=None  #pacer.Pacer with --pace, None otherwise
 
 serv_err_unit=None  #Used by heartbeat
 cli_err_unit=None  #Used by heartbeat
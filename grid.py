@@ -7,9 +7,12 @@
 ##  - A unit is 3 chars wide by default
 ##  - The curse_pos of Grid stores the cursor position relative to the grid.
 ##    The unit size is excluded from this position
+##  - With a Renderer attached (see render), nothing is written straight to the terminal:
+##    output is queued, and the render thread writes it along with any changed cells, once per frame
 ## Important:
 ##  - MoveLinear doesn't calculate the correct position if drawUnit without backstep was used
-import time
+import time,threading,sys
+import profiling
 
 class Grid():
 	def __init__(self, width, height, unit, draw=True):
@@ -18,6 +21,7 @@ class Grid():
 		self.curse_pos=[0,0]  #Cursor position;[horizontal,vertical]
 		self.notif_line=0  #Number of notifications that have been called
 		self.units={}  #Dict of named units for easy reference
+		self.renderer=None
 		#Create a unit if one wasn't passed
 		if type(unit)!=Unit:
 			self.unit=Unit(*unit)
@@ -33,17 +37,17 @@ class Grid():
 		'''Draw grid.
 		This assumes we are currently in the alt buffer'''
 		for h in range(self.height):
-			# printf(f'\033[100m{" "*unit}')
+			# self._write(f'\033[100m{" "*unit}')
 			for w in range(self.width):
-				printf(f'\033[0m{self.unit}')
-			printf('\n\033[0m')
+				self._write(f'\033[0m{self.unit}')
+			self._write('\n\033[0m')
 	def drawPixel(self,colour='\033[42m',offset=0,count=1):
 		'''Draws a single pixel (character) in the current position.
 		Does not return cursor to previous position'''
 		#Move offset
 		if offset:
-			print(f'\033[{offset}C',end='')
-		print(f"{colour}{' '*count}{self.unit.colour}",end='')
+			self._write(f'\033[{offset}C')
+		self._write(f"{colour}{' '*count}{self.unit.colour}")
 	def drawRefUnit(self,ref):
 		'''Draws a unit stored in self.units'''
 		if ref not in self.units:
@@ -53,23 +57,27 @@ class Grid():
 		'''Draws a new unit at current cursor position'''
 		if unit==None:
 			unit=self.unit
-		printf(unit)
+		self._write(str(unit))
 		#Move cursor back to original pos
 		if backstep:
-			printf(f'\033[{unit.size}D')
+			self._write(f'\033[{unit.size}D')
 		else:
 			self.curse_pos[0]+=1
 	def enterGrid(self):
 		'''Sets up the grid, then draws it'''
-		printf('\033[?1049h\033[H')
+		self._write('\033[?1049h\033[H')
 		self.drawGrid()
 		self.goTo()
 	def exitGrid(self):
 		'''Leaves grid and cleans everything up'''
+		if self.renderer:
+			self.renderer.stop()  #Its last frame, while we're still on the grid
+			self.renderer=None  #From here on, flush does nothing and writes go straight to the terminal
 		print('\033[J\033[?1049l')
 	def getLeave(self):
 		'''Prints an exiting message'''
 		self.nnotify("Press [Enter] to finish")
+		self.flush()
 		input()
 		self.exitGrid()
 	def goTo(self, horizontal=0,vertical=0):
@@ -78,7 +86,7 @@ class Grid():
 			horizontal=self.width-1
 		if vertical>self.height-1:
 			vertical=self.height-1
-		printf(f'\033[H\033[{vertical+1};{(horizontal*self.unit.size)+1}H')
+		self._write(f'\033[H\033[{vertical+1};{(horizontal*self.unit.size)+1}H')
 		self.curse_pos[0]=horizontal
 		self.curse_pos[1]=vertical
 	def move(self, horizontal=0,vertical=0):
@@ -92,13 +100,13 @@ class Grid():
 			vertical=0
 		#Convert to directions
 		if horizontal<0:
-			printf(f'\033[{-horizontal*self.unit.size}D')
+			self._write(f'\033[{-horizontal*self.unit.size}D')
 		elif horizontal:
-			printf(f'\033[{horizontal*self.unit.size}C')
+			self._write(f'\033[{horizontal*self.unit.size}C')
 		if vertical<0:
-			printf(f'\033[{-vertical}A')
+			self._write(f'\033[{-vertical}A')
 		elif vertical:
-			printf(f'\033[{vertical}B')
+			self._write(f'\033[{vertical}B')
 		#Update cursor pos
 		self.curse_pos[0]+=horizontal
 		self.curse_pos[1]+=vertical
@@ -117,10 +125,10 @@ class Grid():
 	def notify(self,message,colour='\033[43m',line=0):
 		'''Prints a message at the bottom of the grid'''
 		#Move cursor to bottom
-		printf(f'\033[H\033[{self.height+line}B')
+		self._write(f'\033[H\033[{self.height+line}B')
 		self.notif_line=line
 		#Print message
-		printf(f"{colour}{message}\033[0m\033[K")
+		self._write(f"{colour}{message}\033[0m\033[K")
 	def nnotify(self,message,colour='\033[43m'):
 		'''Prints a message at the bottom of the grid.
 		Automatically goes to next notif line'''
@@ -128,8 +136,24 @@ class Grid():
 		self.notify(message,colour,line=self.notif_line+1)
 	def reset(self):
 		'''Resets grid'''
-		printf('\033[2J\033[H')
+		self._write('\033[2J\033[H')
 		self.drawGrid()
+	def render(self,fps=10,source=None):
+		'''Starts a Renderer for this grid, redrawing at most fps times a second.
+		source() is called before every frame, to set the cells that changed (see Renderer.set)'''
+		self.renderer=Renderer(self,fps,source)
+		self.renderer.start()
+		return self.renderer
+	def flush(self):
+		'''Draws anything queued right away (ex. before waiting on input)'''
+		if self.renderer:
+			self.renderer.frame()
+	def _write(self,text):
+		'''Writes text to the terminal, or queues it for the renderer'''
+		if self.renderer and self.renderer.running:
+			self.renderer.queue(text)
+		else:
+			printf(text)
 	def write(self,text,backstep=False):
 		'''Writes text in default unit'''
 		self.drawUnit(Unit(self.unit.size,content=text))
@@ -154,6 +178,76 @@ class Unit():
 		#Print the unit
 		return f"{self.colour}{' '*l}{self.content}{' '*r}\033[0m"
 
+class Headless():
+	'''Stands in for a Grid when there's no terminal to draw on.
+	Nothing is drawn, and notifications are written to out (stderr by default) as plain lines'''
+	def __init__(self,out=None):
+		self.out=out or sys.stderr
+		self.renderer=None
+	def __getattr__(self,name):
+		#Every drawing call (goTo, write, enterGrid, ...) does nothing
+		return lambda *args,**kwargs:None
+	def notify(self,message,colour=None,line=0):
+		print(message,file=self.out,flush=True)
+	def nnotify(self,message,colour=None):
+		self.notify(message)
+
+class Renderer():
+	'''Draws a grid from one thread, at a fixed frame rate.
+	Cells are kept in a shadow buffer, so a frame only redraws cells that changed since the last one.
+	Each frame is one write: queued output, then the changed cells wrapped in a cursor save/restore,
+	so the cursor is left where the queued output put it'''
+	def __init__(self,grid,fps=10,source=None):
+		self.grid=grid
+		self.interval=1/fps
+		self.source=source
+		self.cells={}  #{(horizontal,vertical):Unit}, what the next frame should show
+		self.shown={}  #Same, for what's on screen now
+		self.pending=[]  #Queued output
+		self.lock=threading.Lock()
+		self.running=False
+		self.done=threading.Event()
+		self.thread=threading.Thread(target=profiling.wrap(self._run),daemon=True)
+	def start(self):
+		self.running=True
+		self.thread.start()
+	def stop(self):
+		'''Draws a last frame, then stops the render thread'''
+		self.done.set()
+		if self.thread.is_alive():
+			self.thread.join()
+		self.frame()
+		self.running=False
+	def set(self,horizontal,vertical,content,colour='\033[100m'):
+		'''Sets a cell's content. It's drawn on the next frame, if it changed'''
+		unit=Unit(self.grid.unit.size,colour,content)
+		with self.lock:
+			self.cells[(horizontal,vertical)]=unit
+	def queue(self,text):
+		with self.lock:
+			self.pending.append(text)
+	def frame(self):
+		'''Draws queued output and every changed cell'''
+		if self.source:
+			self.source()
+		with self.lock:
+			out=self.pending
+			self.pending=[]
+			changed=[(pos,u) for pos,u in self.cells.items() if str(self.shown.get(pos))!=str(u)]
+			if changed:
+				out.append('\0337')
+				size=self.grid.unit.size
+				for (h,v),u in changed:
+					out.append(f'\033[{v+1};{h*size+1}H{u}')
+					self.shown[(h,v)]=u
+				out.append('\0338')
+			if out:
+				sys.stdout.write(''.join(out))
+				sys.stdout.flush()
+	def _run(self):
+		while not self.done.wait(self.interval):
+			self.frame()
+
 #--------------#
 #    Errors    #
 #--------------#
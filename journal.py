@@ -0,0 +1,105 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Append-only journal of port results, for resuming a scan
+## Notes:
+##  - File format:
+##      [0-3]:  Magic (b'DDJ\x01')
+##      [4-7]:  Start of the port range (inclusive)
+##      [8-11]: End of the port range (exclusive)
+##      Then one 7 byte record per classified port: port (2 bytes), result (1 byte), latency (4 byte float, 0 if unknown)
+##  - Records are buffered and written in batches, every `batch` records, every `interval` seconds
+##    (from a timer thread, so records don't wait on the next result), and when closed.
+##    A crash only loses the last `interval` seconds
+##  - A port written twice keeps its last result
+##  - A torn record at the end (crash mid-write) is ignored, and cut off when the journal is reopened
+import struct,threading,atexit,os
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+MAGIC=b'DDJ\x01'
+HEADER=struct.Struct(">4sII")
+RECORD=struct.Struct(">HBf")
+
+class Journal():
+	def __init__(self,path,start,end,batch=256,interval=1.0,*,_f=None):
+		'''Starts a new journal at path (overwriting it) for ports start-end'''
+		self.path=path
+		self.start=start
+		self.end=end
+		self.batch=batch
+		self.interval=interval
+		self.buf=bytearray()
+		self.count=0  #Records in buf
+		self.lock=threading.Lock()
+		if _f==None:
+			_f=open(path,"wb")
+			_f.write(HEADER.pack(MAGIC,start,end))
+			_f.flush()
+		self.f=_f
+		self.closed=threading.Event()
+		self.timer=threading.Thread(target=self._flushLoop,daemon=True)
+		self.timer.start()
+		atexit.register(self.close)  #Ctrl-C, lost data channel, etc...
+	@classmethod
+	def resume(cls,path,results,batch=256,interval=1.0):
+		'''Reopens the journal at path, loading every record into results (a results.ResultStore).
+		Returns the journal, ready to append to'''
+		f=open(path,"r+b")
+		raw=f.read()  #One sequential read
+		if len(raw)<HEADER.size:
+			f.close()
+			raise JournalError(path,"too short")
+		magic,start,end=HEADER.unpack_from(raw)
+		if magic!=MAGIC:
+			f.close()
+			raise JournalError(path,"not a journal")
+		size=(len(raw)-HEADER.size)//RECORD.size*RECORD.size
+		for port,res,latency in RECORD.iter_unpack(memoryview(raw)[HEADER.size:HEADER.size+size]):
+			results.set(port,res,latency or None)
+		#Cut off a torn record
+		f.truncate(HEADER.size+size)
+		f.seek(HEADER.size+size)
+		return cls(path,start,end,batch,interval,_f=f)
+
+	def append(self,port,res,latency=None,attempts=None):
+		'''Records the result of a port.
+		Same arguments as results.ResultStore.set, so it can be a listener'''
+		with self.lock:
+			if self.f==None:
+				return
+			self.buf+=RECORD.pack(port,res,latency or 0.0)
+			self.count+=1
+			if self.count>=self.batch:
+				self._write()
+	def flush(self):
+		'''Writes anything buffered'''
+		with self.lock:
+			if self.f!=None:
+				self._write()
+	def _write(self):
+		if self.buf:
+			self.f.write(self.buf)
+			self.f.flush()
+			self.buf.clear()
+			self.count=0
+	def _flushLoop(self):
+		'''Timer thread: writes whatever is buffered every interval seconds, until closed'''
+		while not self.closed.wait(self.interval):
+			self.flush()
+	def close(self):
+		'''Writes anything buffered, then closes the file'''
+		self.closed.set()
+		with self.lock:
+			if self.f==None:
+				return
+			self._write()
+			os.fsync(self.f.fileno())
+			self.f.close()
+			self.f=None
+		atexit.unregister(self.close)
+
+class JournalError(Exception):
+	def __init__(self,path,reason):
+		super().__init__(f"Bad journal {path}: {reason}")
+		self.path=path
+		self.reason=reason
@@ -0,0 +1,77 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Accept ledger for --fast (connect-only) probing
+## Notes:
+##  - With --fast, the client classifies a port on the connect alone and hangs up right away.
+##    The server accepts, writes down (port, peer, time), and hangs up too
+##  - The server streams its ledger back over the data channel in batches (content type 7, see data.py),
+##    and ends it with an empty batch once every port has been served
+##  - The client then checks every port it saw ACCEPTED against the ledger. If the server never accepted it,
+##    something else did (ex. another program on that port), and the port becomes SRVERR.
+##    This is the same check the ID exchange does, for about half the round trips
+##  - Peers are matched by address when the server saw the client's own address. Behind NAT it can't,
+##    so the port alone has to match
+import struct,socket,threading,time
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+ENTRY=struct.Struct(">H4sHI")  #Port, peer IPv4, peer port, ms since the ledger started
+BATCH=4096  #Entries per unit (must fit in a 0xffff byte payload)
+
+class Ledger():
+	def __init__(self):
+		self.entries=[]  #Server: [(port,peer ip,peer port,ms)]
+		self.sent=0  #Server: entries already sent
+		self.accepted={}  #Client: {port:{(peer ip,peer port)}}
+		self.probed={}  #Client: {port:(local ip,local port)}
+		self.lock=threading.Lock()
+		self.began=time.monotonic()
+		self.done=False  #Client: got the empty batch
+
+	#Server side
+	def add(self,port,peer):
+		'''Writes down an accepted connection from peer ((ip,port)) on port'''
+		entry=(port,socket.inet_aton(peer[0]),peer[1],int((time.monotonic()-self.began)*1000))
+		with self.lock:
+			self.entries.append(entry)
+	def take(self,n=BATCH):
+		'''Returns the next unsent entries (at most n) as a payload'''
+		with self.lock:
+			batch=self.entries[self.sent:self.sent+n]
+			self.sent+=len(batch)
+		return b''.join([ENTRY.pack(*e) for e in batch])
+	def pending(self):
+		'''Returns True if there are unsent entries'''
+		return self.sent<len(self.entries)
+
+	#Client side
+	def probe(self,port,local):
+		'''Remembers the local address ((ip,port)) we connected to port from'''
+		self.probed[port]=local
+	def load(self,payload):
+		'''Adds a batch from the server. An empty one means the ledger is complete'''
+		if not payload:
+			self.done=True
+			return
+		for port,ip,peer_port,_ in ENTRY.iter_unpack(payload):
+			self.accepted.setdefault(port,set()).add((socket.inet_ntoa(ip),peer_port))
+	def confirms(self,port):
+		'''Returns True if the server accepted our connection to port'''
+		peers=self.accepted.get(port)
+		if not peers:
+			return False
+		local=self.probed.get(port)
+		if local==None or all(ip!=local[0] for ip,_ in peers):  #NATed, or we don't know where we came from
+			return True
+		return tuple(local) in peers
+
+def recvUnit(reader,ldg):
+	'''reader.recvUnit (a data.FrameReader), but any ledger units on the way are loaded into ldg.
+	Returns the next other unit, or None if reader timed out, the remote closed, or the ledger is complete'''
+	recv=reader.recvUnit()
+	while ldg and recv and recv.content==7:
+		ldg.load(recv.payload)
+		if ldg.done:
+			return None
+		recv=reader.recvUnit()
+	return recv
@@ -7,6 +7,8 @@
 ##  - Added -o
 from progmenu import EntryArg,EntryFlag
 from os.path import isfile
+import random
+import pacer
 
 def toIFunc(i):
 	'''Converts entry to int'''
@@ -18,22 +20,119 @@ def outfileFunc(o):
 		if input().lower() not in ['y',"yes"]:
 			exit()  #Not sure if this is bad practice to exit here lol
 	return o
+def orderFunc(o):
+	'''Checks the port order exists'''
+	if o not in ["seq","random","stride"]:
+		print(f"\033[91m[|X:menuentries:orderFunc]\033[0m: Unknown port order: {o}")
+		exit(1)
+	return o
+def formatFunc(f):
+	'''Checks the report format exists'''
+	if f not in ["text","json","bin"]:
+		print(f"\033[91m[|X:menuentries:formatFunc]\033[0m: Unknown report format: {f}")
+		exit(1)
+	return f
+def engineFunc(e):
+	'''Checks the scan engine exists'''
+	if e not in ["thread","async","epoll"]:
+		print(f"\033[91m[|X:menuentries:engineFunc]\033[0m: Unknown engine: {e}")
+		exit(1)
+	return e
+def paceFunc(p):
+	'''Parses the global probe rate'''
+	try:
+		return pacer.parseRate(p)
+	except pacer.PacerError as e:
+		print(f"\033[91m[|X:menuentries:paceFunc]\033[0m: {e}")
+		exit(1)
+def paceByFunc(p):
+	'''Parses the per-group probe rate'''
+	try:
+		return pacer.parseGroup(p)
+	except pacer.PacerError as e:
+		print(f"\033[91m[|X:menuentries:paceByFunc]\033[0m: {e}")
+		exit(1)
 
 def helpFunc():
-	print("""dropdetector.py [-cdehiopst]
+	print("""dropdetector.py [-acdehilnopst]
 * Tests if a network is dropping packets, or interfering in any way *
+  -a; --adaptive:    Derive timeouts, retry delays, and concurrency from measured RTTs.
+                     -t and -d become upper limits, -n the most probes in flight
   -c; --chunk=<c>:   Number of ports to test per socket
+  --daemon:          Server only. Keep running and serve many clients at once,
+                     each on its own windows of ports
+  --diff:            Rescan against the last --diff run of the same scan, and only print what changed.
+                     Probes the edges of every run of results first, then a random sample of the rest,
+                     and stops once the sample looks unchanged. Implies --lockstep
   -d; --delay=<d>:   Seconds to wait between failed connections (default 1).
                      Can be a float
   -e; --end=<e>:     End of port range; Exclusive (default 1025)
+  --engine=<e>:      Client scan engine (default thread):
+                       thread: One thread per chunk, one port at a time
+                       async:  One event loop probing many ports at once. Implies --lockstep,
+                               since the server only listens on a whole chunk at once with it
+                       epoll:  One thread per chunk, connecting to the whole chunk at once
+                               with non-blocking sockets (Linux only).
+                               Refused ports aren't retried, so use it with --lockstep
+  --fast:            Connect-only probes: a port is ACCEPTED as soon as it connects, without the ID exchange.
+                     At the end, the server's record of every connection it accepted (its ledger)
+                     turns any ACCEPT it didn't see into a SRVERR. About half the round trips per port.
+                     ACCEPTs only reach --stream/--journal once confirmed, at the end
+  --format=<f>:      Format of the --output file (default text):
+                       text: Ports of each result as ranges (ex. "1-50, 52")
+                       json: {"start":1,"end":1025,"results":{"accept":[[1,50],[52,52]],...}}
+                       bin:  2 bits per port, for all 65536 ports (see report.py).
+                             Compare two with: python report.py old.bin new.bin
   -h; --help:        Prints this page
+  --headless:        Don't draw anything or wait for [Enter]. Results are streamed to stdout
+                     as JSON Lines (see --stream), and messages go to stderr
   -i; --ip=<i>:      Server IP (default 0.0.0.0)
+  --journal=<j>:     Record every result to journal <j> as it comes in
+  -l; --lockstep:    Wait for the server to confirm each chunk is listening before probing it,
+                     and tell it when we're done. Makes --delay unnecessary
+  --metrics=<m>:     Expose metrics in the Prometheus text format (client and server):
+                       <port> or <ip>:<port>: Over HTTP (on 127.0.0.1 unless an ip is given)
+                       <file>: Rewritten every second
+  -n; --concurrency=<n>: Max probes in flight with --engine=async (default 500)
   -o; --output=<o>:  Save results to file <o>
+  --order=<o>:       Order the server hands out ports in (default seq):
+                       seq:    Sequential chunks
+                       random: A seeded random permutation, spread over all chunks
+                       stride: Chunk i gets every Nth port starting at start+i
+  --pace=<r>[/<b>]:  Send at most r probes a second (can be a float), and at most b at once
+                     (default: 10ms worth, at least 1). Shared by every worker, so it holds for any --engine.
+                     With --procs, each worker gets r/n (so with --lockstep, one chunk at a time goes at r/n).
+                     Retries of refused ports aren't paced
+  --pace-by=<g>:<r>[/<b>]: Also limit each group of probes to r a second, b at once. Needs --pace. <g> is:
+                       net24: Each /24 of the target
+                       <N>:   Each block of N ports (ex. 1024: 0-1023, 1024-2047, ...)
+  --port-format=<f>: How the server sends port lists (default 1):
+                       0: Every port, 2 bytes each (for older servers)
+                       1: Ranges or a bitmap, whichever is smaller
+  --profile=<f>:     Profile every client/server thread (cProfile) and sample memory use (tracemalloc).
+                     At the end, writes the combined stats to <f> (open with pstats) and a top 25 summary to <f>.txt
+  --prefetch=<k>:    Port replies the server may send ahead of our requests (default 8),
+                     so starting a chunk never waits on a round trip. Ignored with --lockstep.
+                     Use 0 with older servers
+  --procs=<n>:       Split the probing over n worker processes (default 0: off).
+                     Each worker uses --engine (thread means async here),
+                     with --concurrency/n probes in flight (or fewer, with --adaptive). Implies --lockstep
   -p; --port=<p>:    Data port (default 8080).
                      This port MUST NOT be blocked
   -s; --server:      Run as server
+  --pool:            Server only. Listen on a whole chunk at once and serve
+                     every accept from one selector
+  --seed=<s>:        Seed for --order=random (default: random). Sent to the server in the handshake
+  --stream=<f>:      Stream every result to <f> ("-" for stdout) as one JSON object per line, as they come in:
+                       {"port":80,"status":"accept","latency":0.000412,"attempts":1}
+  --udp:             Probe UDP ports instead of TCP. The server echoes a datagram carrying our ID from every port
+                     of a window (implies --lockstep). Ports are probed in bursts from one socket, whatever --engine is.
+                     ICMP port unreachable is CLOSED. Unanswered ports are sent again in 3 rounds, each waiting twice as
+                     long as the last (-t in all), and DROPPED after that. Linux only
   -t; --timeout=<t>: Socket timeout in seconds (default 3 seconds)
   -r; --start=<s>:   Start of port range; Inclusive (default 1)
+  --resume=<j>:      Continue the scan recorded in journal <j>, only scanning ports it doesn't have.
+                     The port range comes from the journal, and new results are added to it
 
   Graph info:
     - ACPT: Accepted packets.
@@ -55,17 +154,42 @@ def helpFunc():
       Too low of a delay will cause falsely closed ports.
       Too low of a timeout will cause SRVERRs and ultimately hangs the client.
       In localhost testing, a delay<0.6 or a timeout<2 triggers these errors
-    - Setting too big of a port range (such as ~40k) will cause a severe desync of ports""")
+    - Setting too big of a port range (such as ~40k) will cause a severe desync of ports
+    - --engine=async keeps thousands of probes in flight on one thread. Raise --concurrency carefully;
+      each probe holds a file descriptor""")
 
 	return True
 
+EntryFlag("adaptive",['a',"adaptive"],lambda *_:True)  #Adaptive timeouts
 EntryArg("chunk",['c',"chunk"],toIFunc,default=100)  #Number of ports per transmission
 EntryArg("delay",['d',"delay"],lambda d:float(d),default=1)  #Delay between port fails
 EntryArg("end",['e',"end"],lambda e:int(e),default=1024)  #End of port range
 EntryFlag("help",['h',"help"],helpFunc)  #Help page
+EntryFlag("headless",["headless"],lambda *_:True)  #No grid, stream results
+EntryFlag("fast",["fast"],lambda *_:True)  #Connect-only probes, checked against the server's ledger
+EntryFlag("udp",["udp"],lambda *_:True)  #UDP probes
 EntryArg("ip",['i',"ip"],lambda i:str(i),default="0.0.0.0")  #IP of server
 EntryArg("port",['p',"port"],toIFunc,default=8080)  #Data port
+EntryArg("port_format",["port-format"],toIFunc,default=1)  #Port reply format
 EntryFlag("server",['s',"server"],lambda *_:True)  #If this is a server
+EntryFlag("pool",["pool"],lambda *_:True)  #Server listens on whole chunks
+EntryFlag("daemon",["daemon"],lambda *_:True)  #Long-lived multi-client server
+EntryFlag("diff",["diff"],lambda *_:True)  #Differential rescan
 EntryArg("start",['r',"start"],toIFunc,default=1)  #Start of port range
 EntryArg("timeout",['t',"timeout"],toIFunc,default=3)  #Port timeout
 EntryArg("outfile",['o',"output"],outfileFunc,default=None)  #Output file
+EntryArg("metrics",["metrics"],lambda m:str(m),default=None)  #Metrics endpoint or file
+EntryArg("profile",["profile"],lambda p:str(p),default=None)  #Profile output file
+EntryArg("prefetch",["prefetch"],toIFunc,default=8)  #Port reply credits
+EntryArg("pace",["pace"],paceFunc,default=None)  #(rate,burst) for every probe
+EntryArg("pace_by",["pace-by"],paceByFunc,default=None)  #(group,rate,burst) for each group of probes
+EntryArg("format",["format"],formatFunc,default="text")  #Output file format
+EntryArg("journal",["journal"],outfileFunc,default=None)  #Result journal
+EntryArg("resume",["resume"],lambda j:str(j),default=None)  #Journal to resume from
+EntryArg("stream",["stream"],lambda f:str(f),default=None)  #JSON Lines output
+EntryFlag("lockstep",['l',"lockstep"],lambda *_:True)  #Lock-step windows
+EntryArg("order",["order"],orderFunc,default="seq")  #Port scheduling order
+EntryArg("seed",["seed"],toIFunc,default=random.getrandbits(32))  #Seed for random order
+EntryArg("engine",["engine"],engineFunc,default="thread")  #Client scan engine
+EntryArg("concurrency",['n',"concurrency"],toIFunc,default=500)  #Async probes in flight
+EntryArg("procs",["procs"],toIFunc,default=0)  #Worker processes
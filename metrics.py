@@ -0,0 +1,177 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Metrics registry shared by the client and server
+## Notes:
+##  - Every metric lives in REGISTRY, and is created here, at import. Updates are safe from any thread
+##  - Exposed in the Prometheus text format, either over HTTP (any path, ex. /metrics) or as a file
+##    rewritten every interval seconds (see expose)
+##  - A gauge can be given a function instead of being set, which is called on every exposition (ex. threads)
+##  - Result counts, latencies, and retries come from a results.ResultStore listener (record),
+##    which is only added when metrics are exposed
+##  - With --procs, probes in flight are counted in the worker processes, so the client's gauge stays at 0
+import threading,os,atexit
+import http.server
+import results
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+PREFIX="dropdetect_"
+LATENCY_BUCKETS=(0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+
+class Registry():
+	def __init__(self):
+		self.metrics=[]
+		self.lock=threading.Lock()
+	def add(self,metric):
+		with self.lock:
+			self.metrics.append(metric)
+		return metric
+	def render(self):
+		'''Returns every metric in the Prometheus text format (str)'''
+		with self.lock:
+			metrics=list(self.metrics)
+		lines=[]
+		for m in metrics:
+			lines.append(f"# HELP {PREFIX}{m.name} {m.help}")
+			lines.append(f"# TYPE {PREFIX}{m.name} {m.kind}")
+			lines+=m.lines()
+		return '\n'.join(lines)+'\n'
+
+class Counter():
+	kind="counter"
+	def __init__(self,name,help,label=None,values=()):
+		'''label is the name of the one label this counter is split by (if any), values its known values'''
+		self.name=name
+		self.help=help
+		self.label=label
+		self.counts={v:0 for v in values} if label else {None:0}
+		self.lock=threading.Lock()
+	def inc(self,n=1,value=None):
+		with self.lock:
+			self.counts[value]=self.counts.get(value,0)+n
+	def lines(self):
+		with self.lock:
+			counts=dict(self.counts)
+		if self.label==None:
+			return [f"{PREFIX}{self.name} {counts[None]}"]
+		return [f'{PREFIX}{self.name}{{{self.label}="{v}"}} {n}' for v,n in counts.items()]
+
+class Gauge():
+	kind="gauge"
+	def __init__(self,name,help,func=None):
+		'''If func is passed, it's called for the value instead'''
+		self.name=name
+		self.help=help
+		self.func=func
+		self.value=0
+		self.lock=threading.Lock()
+	def inc(self,n=1):
+		with self.lock:
+			self.value+=n
+	def dec(self,n=1):
+		with self.lock:
+			self.value-=n
+	def set(self,value):
+		self.value=value
+	def lines(self):
+		return [f"{PREFIX}{self.name} {self.func() if self.func else self.value}"]
+
+class Histogram():
+	kind="histogram"
+	def __init__(self,name,help,buckets):
+		self.name=name
+		self.help=help
+		self.buckets=buckets  #Upper bounds, ascending
+		self.counts=[0]*(len(buckets)+1)  #Last one is +Inf
+		self.sum=0.0
+		self.lock=threading.Lock()
+	def observe(self,v):
+		i=0
+		while i<len(self.buckets) and v>self.buckets[i]:
+			i+=1
+		with self.lock:
+			self.counts[i]+=1
+			self.sum+=v
+	def lines(self):
+		with self.lock:
+			counts=list(self.counts)
+			total=self.sum
+		toret=[]
+		cum=0
+		for le,n in zip(list(self.buckets)+["+Inf"],counts):
+			cum+=n
+			toret.append(f'{PREFIX}{self.name}_bucket{{le="{le}"}} {cum}')
+		toret.append(f"{PREFIX}{self.name}_sum {total}")
+		toret.append(f"{PREFIX}{self.name}_count {cum}")
+		return toret
+
+REGISTRY=Registry()
+RESULTS=REGISTRY.add(Counter("results_total","Ports classified, by result","result",results.NAMES))
+LATENCY=REGISTRY.add(Histogram("probe_latency_seconds","Connect time of probes that connected",LATENCY_BUCKETS))
+RETRIES=REGISTRY.add(Counter("probe_retries_total","Connects retried after the first (refused ports)"))
+INFLIGHT=REGISTRY.add(Gauge("probes_in_flight","Probes started but not finished"))
+LISTENERS=REGISTRY.add(Gauge("listeners","Ports the server is listening on"))
+SERVED=REGISTRY.add(Counter("served_total","Probes the server answered, by outcome","outcome",("ok","bad")))
+THREADS=REGISTRY.add(Gauge("threads","Live threads",threading.active_count))
+SENT=REGISTRY.add(Counter("data_sent_bytes_total","Bytes sent on the data channel"))
+RECEIVED=REGISTRY.add(Counter("data_received_bytes_total","Bytes received on the data channel"))
+
+def record(port,res,latency=None,attempts=None):
+	'''Counts a result. Same arguments as results.ResultStore.set, so it can be a listener'''
+	RESULTS.inc(1,results.NAMES[res])
+	if latency!=None:
+		LATENCY.observe(latency)
+	if attempts:
+		RETRIES.inc(attempts-1)
+
+def expose(where,interval=1.0):
+	'''Exposes REGISTRY at where: a port or addr:port to serve over HTTP, or a file path.
+	Returns the HTTP server or FileWriter'''
+	addr,_,port=where.rpartition(':')
+	if port.isdigit() and '/' not in where:
+		return serve(addr or "127.0.0.1",int(port))
+	return FileWriter(where,interval)
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+	def do_GET(self):
+		body=REGISTRY.render().encode()
+		self.send_response(200)
+		self.send_header("Content-Type","text/plain; version=0.0.4")
+		self.send_header("Content-Length",str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+	def log_message(self,*args):
+		pass  #Don't draw over the grid
+def serve(addr,port):
+	'''Serves REGISTRY over HTTP from a background thread.
+	Returns the http.server.ThreadingHTTPServer'''
+	httpd=http.server.ThreadingHTTPServer((addr,port),_Handler)
+	httpd.daemon_threads=True
+	threading.Thread(target=httpd.serve_forever,daemon=True).start()
+	return httpd
+
+class FileWriter():
+	'''Rewrites REGISTRY to path every interval seconds, and once more at exit.
+	Written to a temporary file first, so a reader never sees half of it'''
+	def __init__(self,path,interval=1.0):
+		self.path=path
+		self.interval=interval
+		self.stopped=threading.Event()
+		self.thread=threading.Thread(target=self._run,daemon=True)
+		self.thread.start()
+		atexit.register(self.close)
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			self.write()
+	def write(self):
+		with open(self.path+".tmp",'w') as f:
+			f.write(REGISTRY.render())
+		os.replace(self.path+".tmp",self.path)
+	def close(self):
+		'''Stops rewriting, after one last write'''
+		if self.stopped.is_set():
+			return
+		self.stopped.set()
+		self.thread.join()
+		self.write()
+		atexit.unregister(self.close)
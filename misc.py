@@ -5,18 +5,8 @@
 ## Notes:
 def bToI(b):
 	'''Returns an int'''
-	toret=0
-	for i in b:
-		toret=(toret<<8)+i
-	return toret
+	return int.from_bytes(b,"big")
 def iToB(i,length=1):
-	'''Returns a bytes object'''
-	h=hex(i)[2:]
-	if len(h)%2==1:
-		h=f"0{h}"  #Add 0 for stupid bytes object
-	#Add padding zeros if length!=None
-	toret=bytes.fromhex(h)
-	cur_length=len(toret)
-	if cur_length<length:
-		toret=b'\x00'*(length-cur_length)+toret
-	return toret
+	'''Returns a bytes object.
+	Padded with zeros to length, but never truncated'''
+	return i.to_bytes(max(length,(i.bit_length()+7)>>3),"big")
@@ -0,0 +1,151 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Token bucket probe pacing, shared by every client worker
+## Notes:
+##  - One scheduler thread owns the buckets and hands out send slots. Workers never sleep per probe:
+##    they ask for a slot (request) and are told when they have it (a callback from the scheduler thread)
+##      threads: acquire blocks on an Event
+##      asyncio: await wait
+##      epoll:   probe.probePorts has the callback write to a pipe in its epoll set
+##  - The global bucket allows rate probes a second, and up to burst at once.
+##    The default burst is 10ms worth (at least 1), so a late wake-up doesn't cost any rate
+##  - Sub-buckets (optional) limit each group of probes on top of that. Groups are either a /24 of the target ("net24"),
+##    or blocks of N ports (ex. 1024: ports 0-1023, 1024-2047, ...). Groups take turns, so one can't starve the others
+##  - With --procs, every worker process gets its own Pacer with 1/n of the rates (see split)
+##  - Only the first connect of a port is paced. Retries of refused ports (without --lockstep) wait --delay as before
+import threading,time,asyncio,collections
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+
+def parseRate(spec):
+	'''Parses "<rate>[/<burst>]" (probes a second, and at once).
+	Returns (rate,burst), burst None if not given'''
+	rate,_,burst=spec.partition('/')
+	try:
+		rate=float(rate)
+		burst=int(burst) if burst else None
+	except ValueError:
+		raise PacerError(spec)
+	if rate<=0 or burst!=None and burst<1:
+		raise PacerError(spec)
+	return (rate,burst)
+def parseGroup(spec):
+	'''Parses "<net24|N>:<rate>[/<burst>]" (see Notes).
+	Returns (group,rate,burst), group being "net24" or N (int)'''
+	group,_,rate=spec.partition(':')
+	if group!="net24":
+		try:
+			group=int(group)
+		except ValueError:
+			raise PacerError(spec)
+		if group<1:
+			raise PacerError(spec)
+	return (group,)+parseRate(rate)
+
+class Bucket():
+	def __init__(self,rate,burst=None):
+		self.rate=rate
+		self.burst=burst or max(1,int(rate/100))
+		self.tokens=self.burst
+		self.last=time.monotonic()
+	def refill(self,now):
+		self.tokens=min(self.burst,self.tokens+(now-self.last)*self.rate)
+		self.last=now
+	def wait(self):
+		'''Seconds until there's a token'''
+		return max(0,(1-self.tokens)/self.rate)
+
+class Pacer():
+	def __init__(self,rate,burst=None,group=None,group_rate=None,group_burst=None):
+		'''rate/burst are for every probe. If group is "net24" or a number of ports, each group also gets its own group_rate/group_burst bucket'''
+		self.bucket=Bucket(rate,burst)
+		self.group=group
+		self.group_rate=group_rate
+		self.group_burst=group_burst
+		self.groups={}  #{group key:Bucket}
+		self.queues={}  #{group key:deque of callbacks}, in the order they asked
+		self.cond=threading.Condition()
+		self.running=True
+		self.thread=threading.Thread(target=self._run,daemon=True)
+		self.thread.start()
+	def key(self,addr,port):
+		'''Returns the group a probe is in'''
+		if self.group=="net24":
+			return addr.rpartition('.')[0]
+		if self.group:
+			return port//self.group
+		return None
+
+	def request(self,addr,port,granted):
+		'''Asks for a slot to probe addr:port. granted() is called from the scheduler thread once it's ours'''
+		with self.cond:
+			self.queues.setdefault(self.key(addr,port),collections.deque()).append(granted)
+			self.cond.notify()
+	def acquire(self,addr,port):
+		'''Blocks until we can probe addr:port'''
+		ev=threading.Event()
+		self.request(addr,port,ev.set)
+		ev.wait()
+	async def wait(self,addr,port):
+		'''Coroutine version of acquire'''
+		loop=asyncio.get_running_loop()
+		fut=loop.create_future()
+		self.request(addr,port,lambda:loop.call_soon_threadsafe(_resolve,fut))
+		await fut
+	def split(self,n):
+		'''Returns the arguments for a Pacer with 1/n of our rates, for each of n processes sharing them (ex. --procs)'''
+		return (self.bucket.rate/n,max(1,self.bucket.burst//n),
+			self.group,
+			self.group_rate/n if self.group else None,
+			max(1,self.group_burst//n) if self.group_burst else None)
+	def close(self):
+		'''Stops the scheduler. Anyone still waiting stays waiting'''
+		with self.cond:
+			self.running=False
+			self.cond.notify()
+		self.thread.join()
+
+	def _run(self):
+		with self.cond:
+			while self.running:
+				wait=self._grant()
+				self.cond.wait(wait)
+	def _grant(self):
+		'''Hands out every slot there are tokens for, one group at a time.
+		Returns the seconds until another could be, or None if nobody is waiting'''
+		now=time.monotonic()
+		self.bucket.refill(now)
+		wait=None
+		progress=True
+		while progress and self.queues:
+			progress=False
+			for key in list(self.queues):
+				if self.bucket.tokens<1:
+					return self.bucket.wait()
+				sub=None
+				if self.group:
+					sub=self.groups.get(key)
+					if sub==None:
+						sub=self.groups[key]=Bucket(self.group_rate,self.group_burst)
+					sub.refill(now)
+					if sub.tokens<1:
+						wait=sub.wait() if wait==None else min(wait,sub.wait())
+						continue
+					sub.tokens-=1
+				self.bucket.tokens-=1
+				queue=self.queues[key]
+				queue.popleft()()
+				if not queue:
+					del self.queues[key]
+				progress=True
+		return wait
+
+def _resolve(fut):
+	if not fut.done():
+		fut.set_result(None)
+
+class PacerError(Exception):
+	def __init__(self,spec):
+		super().__init__(f"Bad pacing spec: {spec} (expected <rate>[/<burst>], or <net24|ports>:<rate>[/<burst>] for groups)")
+		self.spec=spec
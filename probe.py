@@ -0,0 +1,183 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Non-blocking connect probes, completed in bulk with epoll
+## Notes:
+##  - Linux only (select.epoll)
+##  - probePorts is a plain library call: ports in, {port:(result,latency)} out.
+##    It doesn't touch globe, grid, or the data channel
+##  - Results are the same ints as client.tryPort
+##  - Without an id, a port is ACCEPTED as soon as the connect completes.
+##    With an id, the OK unit is exchanged like client.tryPort, and a bad/missing reply is a SRVERR
+##  - With a pacer.Pacer, ports are asked of it batch at a time, and only started once it grants them.
+##    Grants come from its thread, so they're handed over through a pipe in the epoll set (see _Grants)
+import socket,select,errno,time,os,threading,collections
+import data
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+
+def probePorts(addr,ports,timeout=3,id=None,batch=1000,local=None,pace=None):
+	'''Probes every port in ports.
+	At most batch connects are in flight at once; the rest wait for a free slot.
+	Without an id, the local address each port was connected from is put in local ({port:(ip,port)}) if it's passed.
+	With a pace (pacer.Pacer), a connect only starts once it grants the port.
+	Returns {port:(result,latency)}, latency being the connect time in seconds (None if it never connected)'''
+	toret={}
+	ep=select.epoll()
+	pending={}  #{fd:[socket,port,start,deadline,connected_at,buf]}
+	ports=iter(ports)
+	ok=data.okFrame(id) if id!=None else None
+	grants=_Grants(ep) if pace else None
+	try:
+		while True:
+			#Top up the batch
+			while len(pending)+(grants.asked if grants else 0)<batch:
+				p=next(ports,None)
+				if p==None:
+					break
+				if grants:
+					grants.ask(pace,addr,p)
+				else:
+					_start(ep,pending,toret,addr,p,timeout)
+			while grants and grants.ports:
+				grants.asked-=1
+				_start(ep,pending,toret,addr,grants.ports.popleft(),timeout)
+			if not pending and not (grants and grants.asked):
+				break
+			now=time.monotonic()
+			wait=max(0,min(e[3] for e in pending.values())-now) if pending else -1  #-1: Only waiting on grants
+			for fd,ev in ep.poll(wait):
+				if grants and fd==grants.r:
+					grants.clear()
+					continue
+				_event(ep,pending,toret,fd,ev,ok,id,timeout,local)
+			#Expire anything past its deadline
+			now=time.monotonic()
+			for fd in [fd for fd,e in pending.items() if e[3]<=now]:
+				e=pending[fd]
+				#Never connected=DROPPED, connected but no reply=SRVERR
+				toret[e[1]]=(3,e[4]) if e[4]!=None else (2,None)
+				_finish(ep,pending,fd)
+	finally:
+		for fd in list(pending):
+			_finish(ep,pending,fd)
+		if grants:
+			grants.close()
+		ep.close()
+	return toret
+
+def _start(ep,pending,toret,addr,port,timeout):
+	'''Starts a non-blocking connect to port'''
+	s=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+	s.setblocking(False)
+	start=time.monotonic()
+	err=s.connect_ex((addr,port))
+	if err not in (0,errno.EINPROGRESS):
+		s.close()
+		toret[port]=(1,None) if err==errno.ECONNREFUSED else (2,None)
+		return
+	pending[s.fileno()]=[s,port,start,start+timeout,None,b'']
+	ep.register(s.fileno(),select.EPOLLOUT|select.EPOLLERR|select.EPOLLHUP)
+
+def _event(ep,pending,toret,fd,ev,ok,id,timeout,local=None):
+	'''Handles an epoll event for a pending probe'''
+	e=pending.get(fd)
+	if e==None:
+		return
+	s,port=e[0],e[1]
+	if e[4]==None:  #Still connecting
+		err=s.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR)
+		if err==0 and ev&select.EPOLLOUT:
+			e[4]=time.monotonic()-e[2]
+			if ok==None:  #Connect-only
+				toret[port]=(0,e[4])
+				if local!=None:
+					local[port]=s.getsockname()
+				_finish(ep,pending,fd)
+				return
+			#Send our OK, then wait for the server's
+			try:
+				s.send(ok)
+			except OSError:
+				toret[port]=(3,e[4])
+				_finish(ep,pending,fd)
+				return
+			e[3]=time.monotonic()+timeout
+			ep.modify(fd,select.EPOLLIN|select.EPOLLERR|select.EPOLLHUP)
+		elif err in (errno.ECONNREFUSED,errno.ECONNRESET):
+			toret[port]=(1,None)
+			_finish(ep,pending,fd)
+		else:  #Unreachable, etc...
+			toret[port]=(2,None)
+			_finish(ep,pending,fd)
+		return
+	#Waiting on the server's OK
+	try:
+		recv=s.recv(17-len(e[5]))
+	except BlockingIOError:
+		return
+	except OSError:
+		recv=b''
+	e[5]+=recv
+	if recv and len(e[5])<17:
+		return
+	if len(e[5])==17:
+		toret[port]=(0,e[4]) if data.isOk(e[5],id) else (3,e[4])
+	else:  #Closed early, assume "port in use"
+		toret[port]=(3,e[4])
+	_finish(ep,pending,fd)
+
+class _Grants():
+	'''Ports a pacer.Pacer granted, handed from its thread to probePorts' epoll loop.
+	Every grant writes a byte to a pipe in the epoll set, which wakes the loop up'''
+	def __init__(self,ep):
+		self.r,self.w=os.pipe()
+		os.set_blocking(self.r,False)
+		ep.register(self.r,select.EPOLLIN)
+		self.ports=collections.deque()  #Granted, not started yet
+		self.asked=0  #Asked for, not started yet
+		self.lock=threading.Lock()
+	def ask(self,pace,addr,port):
+		self.asked+=1
+		pace.request(addr,port,lambda:self.grant(port))
+	def grant(self,port):
+		'''Called from the pacer's thread'''
+		with self.lock:
+			if self.w==None:  #probePorts is gone (ex. interrupted)
+				return
+			self.ports.append(port)
+			os.write(self.w,b'\x00')
+	def clear(self):
+		'''Empties the pipe'''
+		try:
+			while os.read(self.r,4096):
+				pass
+		except BlockingIOError:
+			pass
+	def close(self):
+		with self.lock:
+			os.close(self.r)
+			os.close(self.w)
+			self.w=None
+
+def _finish(ep,pending,fd):
+	'''Stops watching a probe and closes its socket'''
+	e=pending.pop(fd)
+	ep.unregister(fd)
+	e[0].close()
+
+if __name__=="__main__":
+	import sys
+	#Ex: python probe.py 127.0.0.1 1 1024
+	addr=sys.argv[1] if len(sys.argv)>1 else "127.0.0.1"
+	start=int(sys.argv[2]) if len(sys.argv)>2 else 1
+	end=int(sys.argv[3]) if len(sys.argv)>3 else 1025
+	t=time.monotonic()
+	res=probePorts(addr,range(start,end),1)
+	t=time.monotonic()-t
+	counts=[0,0,0,0]
+	for r in res.values():
+		counts[r[0]]+=1
+	print(f"[|X:{MY_NAME}]: {len(res)} ports in {t:.2f}s ({len(res)/t:.0f} ports/s)")
+	for name,c in zip(("accept","close","drop","srverr"),counts):
+		print(f"  {name}: {c}")
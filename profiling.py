@@ -0,0 +1,100 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    --profile: cProfile every worker thread, sample tracemalloc, and write one combined report
+## Notes:
+##  - Thread targets are passed through wrap, which returns them untouched unless a Profiler is running,
+##    so there's no cost at all when profiling is off
+##  - Before Python 3.12, cProfile only sees the thread that enabled it, so every wrapped thread gets its own
+##    cProfile.Profile, and they're all merged at the end. From 3.12 on, one profiler sees every thread
+##    (and a second one can't be enabled), so only the main thread's is used
+##  - Threads still running when the scan ends (ex. the asyncio loop) are merged with what they have so far
+##  - tracemalloc is sampled every interval seconds. The top allocation sites come from the biggest sample
+##  - --procs workers are separate processes, and aren't profiled
+import cProfile,pstats,tracemalloc,threading,functools,sys,io,time
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+PER_THREAD=sys.version_info<(3,12)
+ACTIVE=None  #The running Profiler, if any
+
+def wrap(func):
+	'''Returns func, profiled in whatever thread it runs in if a Profiler is running'''
+	if ACTIVE==None or not PER_THREAD:
+		return func
+	return ACTIVE.wrap(func)
+
+class Profiler():
+	def __init__(self,path,interval=1.0,top=25):
+		'''Writes the combined stats to path (pstats format) and a summary to path.txt'''
+		self.path=path
+		self.interval=interval
+		self.top=top
+		self.profiles=[]  #[cProfile.Profile], one per thread
+		self.lock=threading.Lock()
+		self.samples=[]  #[(seconds since start,traced bytes)]
+		self.biggest=None  #(traced bytes,tracemalloc.Snapshot)
+		self.stopped=threading.Event()
+		self.sampler=threading.Thread(target=self._sample,daemon=True)
+		self.main=cProfile.Profile()
+		self.began=None
+	def start(self):
+		global ACTIVE
+		ACTIVE=self
+		self.began=time.monotonic()
+		tracemalloc.start()
+		self.sampler.start()
+		self.main.enable()
+	def wrap(self,func):
+		@functools.wraps(func)
+		def profiled(*args,**kwargs):
+			prof=cProfile.Profile()
+			with self.lock:
+				self.profiles.append(prof)
+			prof.enable()
+			try:
+				return func(*args,**kwargs)
+			finally:
+				prof.disable()
+		return profiled
+	def _sample(self):
+		while not self.stopped.wait(self.interval):
+			self._snapshot()
+	def _snapshot(self):
+		current,_=tracemalloc.get_traced_memory()
+		self.samples.append((round(time.monotonic()-self.began,3),current))
+		if self.biggest==None or current>self.biggest[0]:
+			self.biggest=(current,tracemalloc.take_snapshot())
+
+	def stop(self):
+		'''Stops profiling, then writes the combined profile and the summary'''
+		global ACTIVE
+		self.main.disable()
+		ACTIVE=None
+		self.stopped.set()
+		self.sampler.join()
+		self._snapshot()
+		_,peak=tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		stats=pstats.Stats(self.main)
+		with self.lock:
+			for prof in self.profiles:
+				stats.add(prof)
+		stats.dump_stats(self.path)
+		with open(self.path+".txt",'w') as f:
+			f.write(self.summary(stats,peak))
+		print(f"[|X:{MY_NAME}:stop]: Saved profile to {self.path} (summary in {self.path}.txt)",file=sys.stderr)
+	def summary(self,stats,peak):
+		'''Returns the top functions (by own and cumulative time) and allocation sites, as text'''
+		out=io.StringIO()
+		out.write(f"__--++* DropDetect Profile *++--__\n\nThreads profiled: {len(self.profiles)+1}\n")
+		stats.stream=out
+		for key in ("tottime","cumulative"):
+			out.write(f"\n== Top {self.top} by {key} ==\n")
+			stats.sort_stats(key).print_stats(self.top)
+		out.write(f"\n== Memory (tracemalloc) ==\nPeak traced: {peak/1024:.1f}KiB\n")
+		out.write("Samples (seconds,KiB): "+", ".join([f"{t:g},{b/1024:.0f}" for t,b in self.samples])+'\n')
+		if self.biggest:
+			out.write(f"\nTop {self.top} allocation sites at {self.biggest[0]/1024:.1f}KiB:\n")
+			for s in self.biggest[1].statistics("lineno")[:self.top]:
+				out.write(f"  {s}\n")
+		return out.getvalue()
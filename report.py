@@ -0,0 +1,125 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Report writers (and a reader for the binary format)
+## Notes:
+##  - Writers are looked up by name in WRITERS, and all take (f,store,start,end)
+##  - Ranges come from one linear pass over the results (see runs), which are already in port order
+##  - "text" and "json" only list ports with a result, as ranges ("1-50" in text, [1,50] in JSON)
+##  - Binary format:
+##      [0-3]:  Magic (b'DDR\x01')
+##      [4-7]:  Start of the port range (inclusive)
+##      [8-11]: End of the port range (exclusive)
+##      [12]:   Flags. Bit 0: a scanned mask follows the bitmap
+##      Then 16384 bytes: 2 bits per port for all 65536 ports, MSB first (port 0 is the top 2 bits of the first byte).
+##      The 2 bits are the result (see results.NAMES)
+##      Then, if flagged, 8192 bytes: 1 bit per port, set if the port has a result (MSB first).
+##      Without it, every port in the range has a result, and none outside it do
+import json,struct,sys
+from array import array
+import results
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+MAGIC=b'DDR\x01'
+HEADER=struct.Struct(">4sIIB")
+MASKED=0b1
+_UNPACK=[bytes(((b>>6)&3,(b>>4)&3,(b>>2)&3,b&3)) for b in range(256)]  #Bitmap byte -> 4 results
+
+def runs(store,start,end):
+	'''Yields (first,last,result) for every run of ports with the same result in start-end (end exclusive).
+	Ports without a result end a run'''
+	first=None
+	prev=results.UNSET
+	for i,res in enumerate(store.status.tobytes()[start:end]):
+		if res!=prev:
+			if prev!=results.UNSET:
+				yield (first,start+i-1,prev)
+			first=start+i
+			prev=res
+	if prev!=results.UNSET:
+		yield (first,end-1,prev)
+def ranges(store,start,end):
+	'''Returns {result name:[(first,last)]}'''
+	toret={name:[] for name in results.NAMES}
+	for first,last,res in runs(store,start,end):
+		toret[results.NAMES[res]].append((first,last))
+	return toret
+
+def writeText(f,store,start,end):
+	f.write(f"""__--++* DropDetect Report *++--__\n
+Port range: {start} - {end}\n\n""")
+	for name,rs in ranges(store,start,end).items():
+		f.write(f"{name}: {', '.join([f'{a}-{b}' if a!=b else str(a) for a,b in rs])}\n")
+def writeJson(f,store,start,end):
+	json.dump({"start":start,
+		"end":end,
+		"results":{name:[[a,b] for a,b in rs] for name,rs in ranges(store,start,end).items()}},f)
+	f.write('\n')
+def writeBinary(f,store,start,end):
+	raw=store.status.tobytes()
+	scanned=[res!=results.UNSET for res in raw]
+	#Only store the mask if it says something the range doesn't
+	masked=any(scanned[:start]) or any(scanned[end:]) or not all(scanned[start:end])
+	bits=raw.translate(bytes(range(4))+bytes(252))  #UNSET (and anything else) becomes 0
+	f.write(HEADER.pack(MAGIC,start,end,MASKED if masked else 0))
+	f.write(bytes([bits[i]<<6|bits[i+1]<<4|bits[i+2]<<2|bits[i+3] for i in range(0,results.PORTS,4)]))
+	if masked:
+		f.write(bytes([scanned[i]<<7|scanned[i+1]<<6|scanned[i+2]<<5|scanned[i+3]<<4|scanned[i+4]<<3|scanned[i+5]<<2|scanned[i+6]<<1|scanned[i+7]
+			for i in range(0,results.PORTS,8)]))
+
+WRITERS={"text":(writeText,'w'),
+	"json":(writeJson,'w'),
+	"bin":(writeBinary,"wb")}
+
+def write(path,fmt,store,start,end):
+	'''Writes the results in start-end to path, in format fmt (see WRITERS)'''
+	func,mode=WRITERS[fmt]
+	with open(path,mode) as f:
+		func(f,store,start,end)
+
+def readBinary(path):
+	'''Loads a binary report.
+	Returns (results.ResultStore,start,end)'''
+	with open(path,"rb") as f:
+		raw=f.read()
+	if len(raw)<HEADER.size+results.PORTS//4:
+		raise ReportError(path,"too short")
+	magic,start,end,flags=HEADER.unpack_from(raw)
+	if magic!=MAGIC:
+		raise ReportError(path,"not a binary report")
+	bitmap=raw[HEADER.size:HEADER.size+results.PORTS//4]
+	status=bytearray(b''.join([_UNPACK[b] for b in bitmap]))
+	if flags&MASKED:
+		mask=raw[HEADER.size+results.PORTS//4:HEADER.size+results.PORTS//4+results.PORTS//8]
+		if len(mask)<results.PORTS//8:
+			raise ReportError(path,"mask too short")
+		for i,byte in enumerate(mask):
+			if byte==0xff:
+				continue
+			for b in range(8):
+				if not byte&(0x80>>b):
+					status[i*8+b]=results.UNSET
+	else:
+		status[:start]=bytes((results.UNSET,))*start
+		status[end:]=bytes((results.UNSET,))*(results.PORTS-end)
+	store=results.ResultStore(latency=False)
+	store.status=array('B',status)
+	return (store,start,end)
+
+class ReportError(Exception):
+	def __init__(self,path,reason):
+		super().__init__(f"Bad report {path}: {reason}")
+		self.path=path
+		self.reason=reason
+
+if __name__=="__main__":
+	#Ex: python report.py before.bin after.bin
+	import diff
+	old,start,end=readBinary(sys.argv[1])
+	new,nstart,nend=readBinary(sys.argv[2])
+	start,end=min(start,nstart),max(end,nend)
+	changes=diff.transitions(old,new,start,end)
+	for first,last,o,n in changes:
+		print(f"{first}-{last}: {results.NAMES[o]}->{results.NAMES[n]}" if first!=last else f"{first}: {results.NAMES[o]}->{results.NAMES[n]}")
+	if not changes:
+		print(f"[|X:{MY_NAME}]: No changes")
@@ -0,0 +1,144 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Per-port result store
+## Notes:
+##  - One byte of status per port (all 65536 of them), so memory never depends on the range scanned
+##  - Status values are the same ints as client.tryPort. Unscanned ports are UNSET
+##  - Each worker only writes its own ports, and a single array item write is atomic, so no lock is needed.
+##    Totals and port lists are derived on demand, already in port order
+##  - Attempts (connects made, retries included) are kept per port too, 0 if unknown
+##  - Listeners (see listen) are called on every set, ex. to journal results as they come in.
+##    Results written by other processes (shared stores) are only seen by listeners once announced
+##  - ACCEPTs can be held back from listeners (see hold), so a result that may still change is only announced once
+from array import array
+from multiprocessing import shared_memory
+
+NAMES=("accept","close","drop","srverr")  #Indexed by result
+UNSET=0xff
+PORTS=65536
+
+class ResultStore():
+	def __init__(self,latency=True,shared=False):
+		'''If shared, the arrays live in shared memory so worker processes can write to them (see attach)'''
+		self.shm=None
+		self.listeners=[]
+		self.held=None  #Ports whose ACCEPT hasn't been announced yet, while holding
+		if shared:
+			self.shm=shared_memory.SharedMemory(create=True,size=PORTS*6)
+			self._view(latency)
+			self.status[:]=bytes((UNSET,))*PORTS
+			return
+		self.status=array('B',[UNSET])*PORTS
+		self.latency=array('f',[0.0])*PORTS if latency else None  #Connect time in seconds, 0 if unknown
+		self.attempts=array('B',[0])*PORTS
+	@classmethod
+	def attach(cls,name,latency=True):
+		'''Returns a store using the shared memory of another process' store'''
+		self=cls.__new__(cls)
+		self.listeners=[]
+		self.held=None
+		self.shm=shared_memory.SharedMemory(name=name)
+		self._view(latency)
+		return self
+	def _view(self,latency):
+		'''Points status and latency into self.shm'''
+		self.status=self.shm.buf[:PORTS]
+		self.latency=self.shm.buf[PORTS:PORTS*5].cast('f') if latency else None
+		self.attempts=self.shm.buf[PORTS*5:PORTS*6]
+	def close(self,unlink=False):
+		'''Releases the shared memory, if any'''
+		if self.shm==None:
+			return
+		#Copy the results out, so they're still readable after closing
+		status=array('B',self.status.tobytes())
+		self.status.release()
+		self.status=status
+		if self.latency!=None:
+			lat=array('f',self.latency.tobytes())
+			self.latency.release()
+			self.latency=lat
+		attempts=array('B',self.attempts.tobytes())
+		self.attempts.release()
+		self.attempts=attempts
+		self.shm.close()
+		if unlink:
+			self.shm.unlink()
+		self.shm=None
+	def load(self,other):
+		'''Copies every result and listener from another store'''
+		self.status[:]=array('B',other.status.tobytes())
+		if self.latency!=None and other.latency!=None:
+			self.latency[:]=array('f',other.latency.tobytes())
+		self.attempts[:]=array('B',other.attempts.tobytes())
+		self.listeners=list(other.listeners)
+	def __getitem__(self,port):
+		return self.get(port)
+
+	def listen(self,func):
+		'''Calls func(port,res,latency,attempts) on every set'''
+		self.listeners.append(func)
+	def announce(self,ports):
+		'''Calls the listeners for results set by another process'''
+		if not self.listeners:
+			return
+		for p in ports:
+			res=self.get(p)
+			if res!=None:
+				for func in self.listeners:
+					func(p,res,self.getLatency(p),self.attempts[p] or None)
+
+	def hold(self):
+		'''Holds ACCEPTs back from the listeners until release (ex. fast mode, where the ledger may turn them into SRVERR)'''
+		self.held=set()
+	def release(self):
+		'''Announces every held port with what it is now, and stops holding'''
+		held,self.held=self.held,None
+		if held:
+			self.announce(sorted(held))
+
+	def set(self,port,res,latency=None,attempts=None):
+		'''Records the result (and connect time, and number of connects) of a port'''
+		self.status[port]=res
+		if latency!=None and self.latency!=None:
+			self.latency[port]=latency
+		if attempts!=None:
+			self.attempts[port]=min(attempts,255)
+		if self.held!=None:
+			if res==0:
+				self.held.add(port)
+				return
+			self.held.discard(port)  #Announced now, as what it became
+		if self.listeners:
+			for func in self.listeners:
+				func(port,res,latency,attempts)
+	def get(self,port):
+		'''Returns the result of a port, or None if it hasn't been scanned'''
+		res=self.status[port]
+		return None if res==UNSET else res
+	def getLatency(self,port):
+		'''Returns the connect time of a port, or None if unknown'''
+		if self.latency==None or not self.latency[port]:
+			return None
+		return self.latency[port]
+	def scanned(self):
+		'''Returns the number of ports with a result'''
+		return PORTS-self.status.tobytes().count(UNSET)
+	def done(self,start=0,end=PORTS):
+		'''Returns every port in start-end (end exclusive) with a result'''
+		return [start+i for i,res in enumerate(self.status.tobytes()[start:end]) if res!=UNSET]
+	def sums(self):
+		'''Returns {result name:number of ports}'''
+		raw=self.status.tobytes()  #bytes.count is much faster than array.count
+		return {name:raw.count(i) for i,name in enumerate(NAMES)}
+	def ports(self,res):
+		'''Yields every port with result res, in order'''
+		raw=self.status.tobytes()
+		code=bytes((res,))
+		i=raw.find(code)
+		while i!=-1:
+			yield i
+			i=raw.find(code,i+1)
+	def lists(self):
+		'''Returns {result name:[ports]}'''
+		return {name:list(self.ports(i)) for i,name in enumerate(NAMES)}
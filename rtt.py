@@ -0,0 +1,92 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Adaptive timeout, delay, and concurrency control for the client
+## Notes:
+##  - The RTT estimator is TCP's RTO estimator (RFC 6298):
+##      RTTVAR=(1-BETA)*RTTVAR+BETA*|SRTT-R|
+##      SRTT=(1-ALPHA)*SRTT+ALPHA*R
+##      RTO=SRTT+max(G,K*RTTVAR)
+##  - Only successful connects are sampled. Timeouts aren't (Karn's algorithm), and a DROP doesn't back RTO off,
+##    since dropped ports are an expected result, not congestion
+##  - Concurrency is AIMD: +1 per clean window of results, halved when the drop/close rate spikes
+import threading
+
+ALPHA=1/8
+BETA=1/4
+K=4
+G=0.01  #Clock granularity (seconds)
+
+class Controller():
+	'''Derives per-probe timeouts, retry delays, and a concurrency limit from measured RTTs.
+	timeout and delay are the user's values and act as ceilings (and starting points)'''
+	def __init__(self,timeout=3,delay=1,limit=500,*,min_rto=0.2,window=100,spike=2.0):
+		self.max_rto=timeout
+		self.min_rto=min(min_rto,timeout)
+		self.max_delay=delay
+		self.srtt=None
+		self.rttvar=None
+		self.rto=timeout
+		self.max_limit=limit
+		self.limit=limit
+		self.inflight=0
+		self.window=window  #Results per concurrency decision
+		self.spike=spike  #A window is a spike if its bad rate is this many times the usual rate
+		self.seen=0  #Results in the current window
+		self.bad=0  #Drops and closes in the current window
+		self.bad_rate=None  #Smoothed bad rate of past windows
+		self.lock=threading.Lock()
+		self.cond=threading.Condition(self.lock)
+
+	def sample(self,rtt):
+		'''Feed a measured RTT (seconds)'''
+		with self.lock:
+			if self.srtt==None:
+				self.srtt=rtt
+				self.rttvar=rtt/2
+			else:
+				self.rttvar=(1-BETA)*self.rttvar+BETA*abs(self.srtt-rtt)
+				self.srtt=(1-ALPHA)*self.srtt+ALPHA*rtt
+			self.rto=min(self.max_rto,max(self.min_rto,self.srtt+max(G,K*self.rttvar)))
+	def timeout(self):
+		'''Returns the timeout for the next probe'''
+		return self.rto
+	def retryDelay(self):
+		'''Returns the delay before retrying a refused port.
+		A refusal means the server's listener wasn't up yet, which should take about one RTT'''
+		if self.srtt==None:
+			return self.max_delay
+		return min(self.max_delay,self.srtt+K*self.rttvar)
+	def record(self,res):
+		'''Feed a probe result (same ints as client.tryPort).
+		Every window results, grow or shrink the concurrency limit'''
+		with self.lock:
+			self.seen+=1
+			if res in (1,2):  #CLOSED or DROPPED
+				self.bad+=1
+			if self.seen<self.window:
+				return
+			rate=self.bad/self.seen
+			if self.bad_rate!=None and rate>0.1 and rate>self.bad_rate*self.spike:
+				self.limit=max(1,self.limit//2)
+			else:
+				self.limit=min(self.max_limit,self.limit+1)
+				self.cond.notify()
+			#Spikes are folded in too, so a range that is really blocked stops counting as a spike
+			if self.bad_rate==None:
+				self.bad_rate=rate
+			else:
+				self.bad_rate=(1-ALPHA)*self.bad_rate+ALPHA*rate
+			self.seen=self.bad=0
+
+	def acquire(self):
+		'''Blocks until there is room for another probe (thread engine)'''
+		with self.cond:
+			while self.inflight>=self.limit:
+				self.cond.wait()
+			self.inflight+=1
+	def release(self):
+		'''Frees the slot taken by acquire'''
+		with self.cond:
+			self.inflight-=1
+			self.cond.notify()
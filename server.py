@@ -2,8 +2,8 @@
 ## Version: 0.1
 ## Date:    2021.12.23
 ## Description:    Holds server functions
-import socket,multiprocessing,time,os
-import data,globe
+import socket,multiprocessing,time,os,selectors,threading
+import data,globe,metrics,profiling,ledger
 from misc import iToB,bToI
 
 MY_NAME=__file__[__file__.rfind('/')+1:-3]
@@ -12,12 +12,6 @@ threads_manager={}
 
 def doHandshake(data_addr="0.0.0.0",data_port=8080):
 	'''Starts a data server'''
-	#Default values
-	info_dict={"main_id":None,  #Can't be None!
-	"timeout":3,
-	"port_start":1,
-	"port_end":1025,
-	"port_chunk":100}
 	#Create socket
 	serv=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
 	serv.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
@@ -27,51 +21,109 @@ def doHandshake(data_addr="0.0.0.0",data_port=8080):
 	#Accept connection
 	cli,cli_addr=serv.accept()
 	print(f"[|X:{MY_NAME}:doHandshake]: Got connection from {cli_addr}!")
+	try:
+		info_dict=handshake(cli)
+	except PermissionError:
+		serv.close()
+		raise
+	if info_dict==None:
+		serv.close()
+		return None
+	return (serv,cli,info_dict)
+
+def handshake(cli,claim=None):
+	'''Does the server side of the handshake on an accepted data connection.
+	claim(info_dict) is called right before the final OK, and returns an error message (bytes) to refuse the client with, or None.
+	Returns info_dict, or None (after closing cli) if the client sent something we can't use'''
+	#Default values
+	info_dict={"main_id":None,  #Can't be None!
+	"timeout":3,
+	"port_start":1,
+	"port_end":1025,
+	"port_chunk":100,
+	"lockstep":0,
+	"port_format":0,
+	"port_order":"seq",
+	"port_seed":0,
+	"port_skip":None,
+	"port_directed":0,
+	"port_credit":0,
+	"fast":0,
+	"udp":0}
 	#Receive start of handshake
 	recv=data.recvUnit(cli)
-	if recv.content!=0:
-		print(f"[|X:{MY_NAME}:doHandshake]: Didn't receive handshake! Closing...")
+	if not recv or recv.content!=0:
+		print(f"[|X:{MY_NAME}:handshake]: Didn't receive handshake! Closing...")
 		cli.close()
-		serv.close()
 		return None
 	#Save the ID
 	info_dict["main_id"]=recv.key
-	print(f"[|X:{MY_NAME}:doHandshake]: Main ID: {info_dict['main_id']}")
+	print(f"[|X:{MY_NAME}:handshake]: Main ID: {info_dict['main_id']}")
 	#Send OK
 	ok_unit=data.Unit(b'\x08'+info_dict["main_id"])
-	cli.send(ok_unit.raw)
+	data.sendUnit(cli,ok_unit)
 	#Receive info
 	while True:
 		recv=data.recvUnit(cli)
+		if not recv or not recv.payload:
+			print(f"[|X:{MY_NAME}:handshake]: Client left during the handshake")
+			cli.close()
+			return None
 		if recv.payload[0]==0xff:
-			print(f"[|X:{MY_NAME}:doHandshake]: Finished setup")
+			print(f"[|X:{MY_NAME}:handshake]: Finished setup")
 			break
 		try:
 			#print(recv)
 			toadd=data.handshake_payload_types[recv.payload[0]]
 			info_dict[toadd[0]]=toadd[1](recv.payload[1:])
 		except KeyError:
-			print(f"[|X:{MY_NAME}:doHandshake]: Client send a non-existent payload type: {hex(recv.payload[0])}")
+			print(f"[|X:{MY_NAME}:handshake]: Client send a non-existent payload type: {hex(recv.payload[0])}")
 			unit=data.Unit(b'\x44'+info_dict["main_id"])
 			unit.setPayload(b"BAD_HANDSHAKE_PAYLOAD:"+recv.payload[0:1])
-			cli.send(unit.raw)
+			data.sendUnit(cli,unit)
+			cli.close()
+			return None
+		except IndexError:  #Value out of range (ex. unknown port order)
+			print(f"[|X:{MY_NAME}:handshake]: Client sent a bad value for payload type: {hex(recv.payload[0])}")
+			unit=data.Unit(b'\x44'+info_dict["main_id"])
+			unit.setPayload(b"BAD_HANDSHAKE_VALUE:"+recv.payload[0:1])
+			data.sendUnit(cli,unit)
 			cli.close()
-			serv.close()
 			return None
+	#Make sure we can encode port replies the way the client wants
+	if info_dict["port_format"] not in data.PORT_FORMATS:
+		print(f"[|X:{MY_NAME}:handshake]: Client wants an unknown port format: {info_dict['port_format']}")
+		unit=data.Unit(b'\x44'+info_dict["main_id"])
+		unit.setPayload(b'BAD_PORT_FORMAT')
+		data.sendUnit(cli,unit)
+		cli.close()
+		return None
 	#Check for well-known ports, and see if we have enough permissions
 	if info_dict["port_start"]<1024 and os.getuid():  #UID is anything but 0
-		print(f"[|X:{MY_NAME}:doHandshake]: Not enough permissions to start!")
+		print(f"[|X:{MY_NAME}:handshake]: Not enough permissions to start!")
 		ok_unit=data.Unit(b'\x44'+info_dict["main_id"])
 		ok_unit.setPayload(b'NOT_ENOUGH_PERMISSION')
-		cli.send(ok_unit.raw)
+		data.sendUnit(cli,ok_unit)
+		cli.close()
 		raise PermissionError
+	#Let the caller refuse the client (ex. its ID is already in use)
+	if claim:
+		message=claim(info_dict)
+		if message:
+			print(f"[|X:{MY_NAME}:handshake]: Refused client: {message.decode()}")
+			unit=data.Unit(b'\x44'+info_dict["main_id"])
+			unit.setPayload(message)
+			data.sendUnit(cli,unit)
+			cli.close()
+			return None
 	#Send OK
-	cli.send(ok_unit.raw)
-	print(f"[|X:{MY_NAME}:doHandshake]: Finished handshake!")
-	return (serv,cli,info_dict)
+	data.sendUnit(cli,ok_unit)
+	print(f"[|X:{MY_NAME}:handshake]: Finished handshake!")
+	return info_dict
 
-def tryPort(addr,port,timeout):
-	'''Tries to receive data on port
+def tryPort(addr,port,timeout,ldg=None):
+	'''Tries to receive data on port.
+	With a ledger.Ledger (fast mode), the connection is only written down
 	Returns an int:
 		0=Ok
 		1=Bad'''
@@ -81,6 +133,7 @@ def tryPort(addr,port,timeout):
 	server.settimeout(timeout)
 	server.bind((addr,port))
 	server.listen()
+	metrics.LISTENERS.inc()
 	try:
 		print(f"[|X:{MY_NAME}:tryPort]: Trying port {port}...")
 		client,cli_addr=server.accept()
@@ -88,12 +141,22 @@ def tryPort(addr,port,timeout):
 	except socket.timeout:
 		print(f"[|X:{MY_NAME}:tryPort]: ({port}) Timedout")
 		return 2
+	finally:
+		metrics.LISTENERS.dec()
+	if ldg:
+		ldg.add(port,cli_addr)
+		metrics.SERVED.inc(1,"ok")
+		client.close()
+		server.close()
+		return 0
 	#Get OK
 	unit=data.Unit(data.recvFrom(client,17))  #Only expecting 17 bytes
 	#print(f"|X:{MY_NAME}:tryPort]: Unit: {unit}")
 	if not unit.status:
 		#print(f"[|X:{MY_NAME}:tryPort]: Bad request!")
+		metrics.SERVED.inc(1,"bad")
 		return 1
+	metrics.SERVED.inc(1,"ok")
 	#print(f"[|X:{MY_NAME}:tryPort]: Got OK!")
 	#Reply with OK
 	unit.setWhoByte(0b01001000)
@@ -103,16 +166,14 @@ def tryPort(addr,port,timeout):
 	client.close()
 	server.close()
 
-def minion_thread(data_addr,ports,timeout):
+def minion_thread(data_addr,ports,timeout,ldg=None):
 	'''Main thread for threads spawned by thread_manager_main'''
-	#Convert ports to int list
-	port_list=[bToI(ports[i:i+2]) for i in range(0,len(ports),2)]
 	#Loop through all ports
 	timeout_ext=1
-	for p in port_list:
+	for p in ports:
 		#print(f"[|X:{MY_NAME}:minion_thread]: Trying port {p}...")
 		try:
-			tryPort(data_addr,p,timeout*timeout_ext)
+			tryPort(data_addr,p,timeout*timeout_ext,ldg)
 		except OSError as e:
 			if e.errno==98:  #Port in use
 				print(f"[|X:{MY_NAME}:tryPort]: Port {p} already in use! Extending timeout for next port")
@@ -121,6 +182,275 @@ def minion_thread(data_addr,ports,timeout):
 		timeout_ext=1
 	return True
 
+class ListenerPool():
+	'''Binds and listens on a whole window of ports up front.
+	Every listener and accepted connection is driven by one selector.
+	With a ledger.Ledger (fast mode), accepted connections are written down and closed right away.
+	With udp, every port gets a UDP socket instead, which echoes probes back (see data.py: UDP Probes)'''
+	def __init__(self,addr,ports,timeout,ldg=None,udp=False):
+		self.addr=addr
+		self.ports=ports  #List of ints
+		self.timeout=timeout
+		self.ledger=ldg
+		self.udp=udp
+		self.sel=selectors.DefaultSelector()
+		self.listeners={}  #{port:socket}
+		self.served=set()  #Ports that answered a client
+		self.busy=[]  #Ports already in use by something else
+	def open(self):
+		'''Bind and listen on every port in the window'''
+		for p in self.ports:
+			server=socket.socket(socket.AF_INET,socket.SOCK_DGRAM if self.udp else socket.SOCK_STREAM)
+			if not self.udp:  #UDP would share the port with anyone else who set it
+				server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+			try:
+				server.bind((self.addr,p))
+			except OSError as e:
+				server.close()
+				if e.errno==98:  #Port in use
+					print(f"[|X:{MY_NAME}:ListenerPool]: Port {p} already in use!")
+					self.busy.append(p)
+					continue
+				self.close()
+				raise
+			if not self.udp:
+				server.listen()
+			server.setblocking(False)
+			self.listeners[p]=server
+			self.sel.register(server,selectors.EVENT_READ,(p,None))
+			metrics.LISTENERS.inc()
+		return len(self.listeners)
+	def serve(self,stop=None):
+		'''Serve accepts until every listener has answered a client,
+		or nothing happened for 2 timeouts (a client thread may sit through a drop before its next port).
+		If stop is a socket, only return once it is readable (the client says the window is done).
+		Returns True if stopped by stop'''
+		if stop:
+			self.sel.register(stop,selectors.EVENT_READ,(None,None))
+		idle=self.timeout*2
+		last=time.monotonic()
+		try:
+			while stop or len(self.served)<len(self.listeners):
+				events=self.sel.select(None if stop else max(0,last+idle-time.monotonic()))
+				if not events:
+					if time.monotonic()-last>=idle:
+						break
+					continue
+				for key,_ in events:
+					p,buf=key.data
+					if p==None:  #Stop socket
+						return True
+					last=time.monotonic()
+					if buf==None:  #Listener
+						self._accept(key.fileobj,p)
+					else:
+						self._read(key.fileobj,p,buf)
+		finally:
+			if stop:
+				self.sel.unregister(stop)
+		return False
+	def _accept(self,server,p):
+		'''Accept a client on port p'''
+		if self.udp:
+			return self._echo(server,p)
+		try:
+			client,cli_addr=server.accept()
+		except BlockingIOError:
+			return False
+		if self.ledger:
+			self.ledger.add(p,cli_addr)
+			client.close()
+			self.served.add(p)
+			metrics.SERVED.inc(1,"ok")
+			return True
+		client.setblocking(False)
+		self.sel.register(client,selectors.EVENT_READ,(p,bytearray()))
+		return True
+	def _echo(self,server,p):
+		'''Echo every probe waiting on UDP port p back to whoever sent it'''
+		toret=False
+		while True:
+			try:
+				buf,cli_addr=server.recvfrom(64)
+			except (BlockingIOError,InterruptedError):
+				return toret
+			except OSError:  #Ex. an ICMP error for an earlier echo
+				continue
+			toret=True
+			if len(buf)<17 or not buf[0]>>3&0b1:  #Not a probe with status OK
+				metrics.SERVED.inc(1,"bad")
+				continue
+			buf=bytearray(buf)
+			buf[0]=0b01000000|(buf[0]&0b00111100)  #Same unit, from the server
+			try:
+				server.sendto(buf,cli_addr)
+			except OSError:
+				pass
+			self.served.add(p)
+			metrics.SERVED.inc(1,"ok")
+	def _drain(self):
+		'''Accept whatever is still queued on the listeners (fast mode: every accept must make the ledger)'''
+		for p,server in self.listeners.items():
+			while self._accept(server,p):
+				pass
+	def _read(self,client,p,buf):
+		'''Read the client's OK, then reply with our own'''
+		try:
+			recv=client.recv(17-len(buf))
+		except (BlockingIOError,InterruptedError):
+			return
+		except OSError:
+			recv=b''
+		buf+=recv
+		if recv and len(buf)<17:
+			return
+		self.sel.unregister(client)
+		if len(buf)==17:
+			who_byte,key=data.unpackHeader(buf)
+			if who_byte>>3&0b1:  #Status OK
+				#Reply with OK, reusing the client's buffer (and key)
+				buf[0]=0b01001000
+				try:
+					client.send(buf)
+				except OSError:
+					pass
+				self.served.add(p)
+				metrics.SERVED.inc(1,"ok")
+			else:
+				metrics.SERVED.inc(1,"bad")
+		client.close()
+	def close(self):
+		'''Close every listener and any connection still open'''
+		if self.ledger:
+			self._drain()
+		for key in list(self.sel.get_map().values()):
+			if key.data[0]!=None:
+				key.fileobj.close()
+		self.sel.close()
+		metrics.LISTENERS.dec(len(self.listeners))
+		self.listeners={}
+
+def pool_thread(data_addr,ports,timeout,ldg=None):
+	'''Same as minion_thread, but listens on every port of the chunk at once'''
+	pool=ListenerPool(data_addr,list(ports),timeout,ldg)
+	pool.open()
+	return window_thread(pool)
+
+def window_thread(win):
+	'''Serves an already open window until it's done, then closes it'''
+	try:
+		win.serve()
+	finally:
+		win.close()
+	print(f"[|X:{MY_NAME}:window_thread]: Served {len(win.served)}/{len(win.ports)} ports")
+	return True
+
+def serveSession(cli,info_dict,addr,pool=False,windows=None):
+	'''Hands out ports to a client that finished its handshake, until it has all of them.
+	windows(ports,timeout,ldg,udp) returns an unopened window (a ListenerPool by default).
+	If windows is passed, pool is True, or the client probes over UDP, chunks are served as windows,
+	otherwise one port at a time by minion_thread.
+	Returns True once done, None if the client misbehaved (cli is closed either way)'''
+	if windows==None:
+		windows=lambda ports,timeout,ldg,udp:ListenerPool(addr,ports,timeout,ldg,udp)
+	else:
+		pool=True
+	if info_dict["udp"]:
+		pool=True
+	reader=data.FrameReader(cli)
+	thread_list=[]
+	window=0  #Lock-step window number
+	#Port replies we can still send without a request (see data.py: Port Credits)
+	credits=0 if info_dict["lockstep"] or info_dict["port_directed"] else info_dict["port_credit"]
+	pushed=0  #Replies sent on credit
+	ldg=ledger.Ledger() if info_dict["fast"] else None
+	def sendLedger(final=False):
+		'''Sends the ledger entries the client doesn't have yet, then the empty ledger unit if final'''
+		while ldg.pending() or final:
+			unit=data.Unit(b'\x7c'+info_dict["main_id"])
+			unit.setPayload(ldg.take())
+			data.sendUnit(cli,unit)
+			if not unit.payload:
+				return
+	try:
+		ports=data.Ports(info_dict["port_start"],
+			info_dict["port_end"],
+			info_dict["port_chunk"],
+			info_dict["port_order"],
+			info_dict["port_seed"],
+			info_dict["port_skip"])
+		while True:
+			if credits:
+				credits-=1
+				pushed+=1
+			else:
+				#Wait for client port request
+				recv=reader.recvUnit()
+				if not recv or not recv.status or recv.content!=2:
+					print(f"[|X:{MY_NAME}:serveSession]: Non/bad port request from client")
+					unit=data.Unit(b'\xc4'+info_dict["main_id"])
+					unit.setPayload(b"BAD_PORT_REQUEST")
+					return None
+			if info_dict["port_directed"] and recv.payload:
+				#The client picked its own ports. Only hand out the ones in the agreed range
+				p=data.decodePorts(recv.payload,1)
+				p=[x for x in p if info_dict["port_start"]<=x<info_dict["port_end"]] if p else range(0)
+			else:
+				p=next(ports)
+			if ldg:
+				sendLedger()
+			#Send next ports
+			print(f"[|X:{MY_NAME}:serveSession]: Sending: {p}")
+			unit=data.Unit(b'\xbc'+info_dict["main_id"])
+			unit.setPayload(data.encodePorts(p,info_dict["port_format"]))
+			data.sendUnit(cli,unit)
+			if not p:  #That was the last one
+				break
+			if info_dict["lockstep"]:
+				#Listen on the whole window, tell the client, then serve until it's done
+				win=windows(list(p),info_dict["timeout"],ldg,info_dict["udp"])
+				try:
+					win.open()
+					unit=data.Unit(b'\x6c'+info_dict["main_id"])
+					unit.setPayload(iToB(window,4))
+					data.sendUnit(cli,unit)
+					if not reader.pending():
+						win.serve(stop=cli)
+				finally:
+					win.close()
+				recv=reader.recvUnit()
+				if not recv or recv.content!=6 or bToI(recv.payload)!=window:
+					print(f"[|X:{MY_NAME}:serveSession]: Client didn't finish window {window}")
+					return None
+				if ldg:
+					sendLedger()
+				window+=1
+				continue
+			#Spawn threads
+			if pool:
+				win=windows(list(p),info_dict["timeout"],ldg,info_dict["udp"])
+				win.open()
+				thread_list.append(threading.Thread(target=profiling.wrap(window_thread),args=(win,)))
+			else:
+				thread_list.append(threading.Thread(target=profiling.wrap(minion_thread),
+				args=(addr,
+					p,
+					info_dict["timeout"],
+					ldg)))
+			thread_list[-1].start()
+		#The client gives a credit back for every reply but the last, and pushed-1 of those are still unread.
+		#Read them, so closing doesn't reset the connection (and drop anything we sent last)
+		for _ in range(pushed-1):
+			reader.recvUnit()
+		#Join threads
+		for t in thread_list:
+			t.join()
+		if ldg:
+			sendLedger(final=True)
+		return True
+	finally:
+		cli.close()
+
 def heartbeat(serv,cli,heartbeat_id,bps=3):
 	'''Main thread to start a heartbeat and allow sending messages to/from server'''
 	#Set client timeout to bps+1 (+1 as a buffer)
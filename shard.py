@@ -0,0 +1,143 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Multi-process sharded client
+## Notes:
+##  - The parent keeps the data channel and the grid. Chunks are handed to N worker processes through a queue
+##  - Workers write results straight into a shared memory results.ResultStore,
+##    then send back only the chunk's number once it's done
+##  - Each worker probes its chunks on its own event loop (or with probe.probePorts for the epoll engine),
+##    with limit//n probes in flight
+##  - With --adaptive, each worker runs its own rtt.Controller, whose limit caps its probes in flight
+##  - With --pace, each worker runs its own pacer.Pacer, with 1/n of the rates
+import multiprocessing,threading,asyncio,os
+import concurrent.futures
+import globe,results,client,asyncscan,probe,rtt,profiling,pacer
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+
+class ShardPool():
+	'''Same interface as asyncscan.Engine, but spread over n processes'''
+	def __init__(self,n,limit=500,engine="async",adaptive=None):
+		'''adaptive is None, or (timeout,delay) to build each worker's rtt.Controller from'''
+		self.n=n
+		#Workers write into shared memory, so swap the global store for a shared one
+		store=results.ResultStore(shared=True)
+		store.load(globe.results)  #Keep anything already there (--resume), and its listeners
+		globe.results=store
+		ctx=multiprocessing.get_context("fork")
+		self.tasks=ctx.Queue()
+		self.done=ctx.Queue()
+		self.procs=[ctx.Process(target=_worker,
+			args=(globe.results.shm.name,self.tasks,self.done,engine,max(1,limit//n),adaptive,
+				globe.pacer.split(n) if globe.pacer else None),
+			daemon=True) for _ in range(n)]
+		for p in self.procs:
+			p.start()
+		self.futures={}  #{chunk number:(concurrent.futures.Future,screen,ports)}
+		self.next_id=0
+		self.lock=threading.Lock()
+		self.collector=threading.Thread(target=profiling.wrap(self._collect),daemon=True)
+		self.collector.start()
+
+	def _collect(self):
+		'''Parent thread: marks chunks done as workers report them'''
+		while True:
+			cid=self.done.get()
+			if cid==None:
+				return
+			with self.lock:
+				fut,screen,ports=self.futures[cid]
+			globe.results.announce(ports)  #Workers' sets never reach our listeners
+			client.chunkDone(screen)
+			fut.set_result(True)
+	def minion(self,addr,ports,timeout,delay,screen,tries=3):
+		'''Hand a chunk to the workers.
+		Returns a concurrent.futures.Future'''
+		fut=concurrent.futures.Future()
+		with self.lock:
+			cid=self.next_id
+			self.next_id+=1
+			self.futures[cid]=(fut,screen,ports)
+		self.tasks.put((cid,addr,ports,timeout,delay,tries))
+		return fut
+	def join(self):
+		'''Wait for every chunk, then stop the workers.
+		The shared results are copied back into normal memory'''
+		for f,*_ in list(self.futures.values()):
+			f.result()
+		for _ in self.procs:
+			self.tasks.put(None)
+		for p in self.procs:
+			p.join()
+		self.done.put(None)
+		self.collector.join()
+		globe.results.close(unlink=True)
+
+def _worker(shm_name,tasks,done,engine,limit,adaptive,pace=None):
+	'''Worker process: probe chunks until the parent sends None.
+	pace is None, or the arguments for this worker's pacer.Pacer'''
+	if globe.results.shm==None or globe.results.shm.name!=shm_name:  #Not forked from the parent
+		globe.results=results.ResultStore.attach(shm_name)
+	globe.results.listeners=[]  #They belong to the parent (ex. its journal)
+	ctl=rtt.Controller(adaptive[0],adaptive[1],limit) if adaptive else None
+	globe.pacer=pacer.Pacer(*pace) if pace else None  #The parent's scheduler thread didn't survive the fork
+	try:
+		if engine=="epoll":
+			while True:
+				task=tasks.get()
+				if task==None:
+					break
+				cid,addr,ports,timeout,delay,tries=task
+				if ctl:
+					timeout=ctl.timeout()
+				for p,(res,latency) in probe.probePorts(addr,ports,timeout,os.urandom(16),ctl.limit if ctl else limit,None,globe.pacer).items():
+					if ctl:
+						if latency!=None:
+							ctl.sample(latency)
+						ctl.record(res)
+					globe.results.set(p,res,latency,1)
+				done.put(cid)
+		else:
+			asyncio.run(_asyncWorker(tasks,done,limit,ctl))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		globe.results.close()
+
+async def _asyncWorker(tasks,done,limit,ctl):
+	'''Pulls chunks off the queue and probes several at once,
+	limit probes in flight (or ctl's limit, which moves with its RTTs)'''
+	loop=asyncio.get_running_loop()
+	cond=asyncio.Condition()
+	inflight=0
+	running=set()
+	async def one(id,addr,port,timeout,delay,tries):
+		nonlocal inflight
+		async with cond:
+			while inflight>=(ctl.limit if ctl else limit):
+				await cond.wait()
+			inflight+=1
+		try:
+			if globe.pacer:
+				await globe.pacer.wait(addr,port)
+			res,latency,attempts=await asyncscan.probePort(id,addr,port,timeout,delay,tries,ctl)
+		finally:
+			async with cond:
+				inflight-=1
+				#Same as asyncscan.Engine: ctl may have raised the limit
+				cond.notify(max(1,(ctl.limit if ctl else limit)-inflight))
+		globe.results.set(port,res,latency,attempts)
+	async def chunk(cid,addr,ports,timeout,delay,tries):
+		id=os.urandom(16)
+		await asyncio.gather(*[one(id,addr,p,timeout,delay,tries) for p in ports])
+		done.put(cid)
+	while True:
+		task=await loop.run_in_executor(None,tasks.get)
+		if task==None:
+			break
+		t=asyncio.create_task(chunk(*task))
+		running.add(t)
+		t.add_done_callback(running.discard)
+	if running:
+		await asyncio.gather(*running)
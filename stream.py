@@ -0,0 +1,61 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    Streams results as JSON Lines while the scan runs
+## Notes:
+##  - One object per classified port:
+##      {"port":80,"status":"accept","latency":0.000412,"attempts":1}
+##    latency is the connect time in seconds, and latency/attempts are null if unknown
+##  - Lines are buffered and written in batches, every `batch` lines or `interval` seconds, and when closed
+import sys,threading,time,atexit
+import results
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+
+class JsonlWriter():
+	def __init__(self,f,batch=512,interval=0.5):
+		'''f is any text file object (ex. sys.stdout)'''
+		self.f=f
+		self.batch=batch
+		self.interval=interval
+		self.lines=[]
+		self.last=time.monotonic()  #Last write
+		self.lock=threading.Lock()
+		self.closed=False
+		atexit.register(self.close)
+	@classmethod
+	def open(cls,path,batch=512,interval=0.5):
+		'''Returns a writer for path, or stdout if path is "-"'''
+		return cls(sys.stdout if path=="-" else open(path,'w'),batch,interval)
+
+	def append(self,port,res,latency=None,attempts=None):
+		'''Streams the result of a port.
+		Same arguments as results.ResultStore.set, so it can be a listener'''
+		line=f'{{"port":{port},"status":"{results.NAMES[res]}","latency":{"null" if latency==None else round(latency,6)},"attempts":{"null" if attempts==None else attempts}}}\n'
+		with self.lock:
+			if self.closed:
+				return
+			self.lines.append(line)
+			if len(self.lines)>=self.batch or time.monotonic()-self.last>=self.interval:
+				self._write()
+	def flush(self):
+		'''Writes anything buffered'''
+		with self.lock:
+			if not self.closed:
+				self._write()
+	def _write(self):
+		if self.lines:
+			self.f.write(''.join(self.lines))
+			self.f.flush()
+			self.lines.clear()
+		self.last=time.monotonic()
+	def close(self):
+		'''Writes anything buffered, then closes the file (unless it's stdout)'''
+		with self.lock:
+			if self.closed:
+				return
+			self._write()
+			self.closed=True
+			if self.f!=sys.stdout:
+				self.f.close()
+		atexit.unregister(self.close)
@@ -0,0 +1,162 @@
+## Author:  Owen Cocjin
+## Version: 0.1
+## Date:    2026.10.18
+## Description:    UDP probes: bursts of datagrams from one socket, matched to the server's echoes by ID
+## Notes:
+##  - Linux only (IP_RECVERR)
+##  - Like probe.probePorts, probePorts is a plain library call: ports in, {port:(result,latency,attempts)} out
+##  - Every probe carries our ID, its port, and its round (see data.py: UDP Probes), and the server echoes it back.
+##    An echo with our ID is ACCEPTED, anything else coming back from that port is SRVERR
+##  - With IP_RECVERR, the ICMP errors our probes cause are queued on the socket (MSG_ERRQUEUE),
+##    along with the port they were sent to. Port unreachable is CLOSED, any other unreachable is DROPPED
+##  - Ports nobody answered are sent again in the next round. Each round waits twice as long as the one before,
+##    and all of them add up to timeout. Whatever's still unanswered after the last one is DROPPED
+##  - Probes go out in bursts, and replies are read between bursts so the receive buffer doesn't overflow
+##  - The kernel rate limits the ICMP errors it sends (net.ipv4.icmp_ratelimit), so on a real network
+##    a closed port may only be seen as one in a later round, or look DROPPED
+import socket,select,errno,struct,time,os
+import data
+
+MY_NAME=__file__[__file__.rfind('/')+1:-3]
+IP_RECVERR=getattr(socket,"IP_RECVERR",11)
+MSG_ERRQUEUE=getattr(socket,"MSG_ERRQUEUE",0x2000)
+EXTENDED_ERR=struct.Struct("=IBBBBII")  #struct sock_extended_err: errno, origin, ICMP type, ICMP code, pad, info, data
+PROBE=struct.Struct(">HB")  #Port, round
+CLIENT_WHO=0b11001100  #Client, informational, status OK, payload
+SERVER_WHO=0b01001100  #Same, from the server
+ROUNDS=3
+BURST=256  #Probes sent between reads
+RCVBUF=1<<22
+UNREACHABLE=(errno.ECONNREFUSED,errno.EHOSTUNREACH,errno.ENETUNREACH)  #An earlier probe's ICMP error
+
+def probePorts(addr,ports,timeout=3,id=None,rounds=ROUNDS,burst=BURST,pace=None):
+	'''Probes every port in ports over UDP.
+	With a pace (pacer.Pacer), every probe waits for it first.
+	Returns {port:(result,latency,attempts)}, latency being the time until the echo (None without one)'''
+	scan=_Scan(addr,id or os.urandom(16))
+	try:
+		left=list(ports)
+		share=timeout/(2**rounds-1)
+		for r in range(rounds):
+			for i in range(0,len(left),burst):
+				for p in left[i:i+burst]:
+					if p in scan.toret:  #Answered (or refused) since the round began
+						continue
+					if pace:
+						pace.acquire(addr,p)
+					scan.send(p,r)
+				scan.read()
+			#Wait for the stragglers, or until every port has its answer
+			end=time.monotonic()+share*2**r
+			while len(scan.toret)<len(scan.sent):
+				wait=end-time.monotonic()
+				if wait<=0:
+					break
+				if scan.poller.poll(wait*1000):
+					scan.read()
+			left=[p for p in left if p not in scan.toret]
+			if not left:
+				break
+		for p in left:
+			scan.toret[p]=(2,None,len(scan.sent[p]))
+	finally:
+		scan.close()
+	return scan.toret
+
+class _Scan():
+	'''One probePorts call: its socket, and what it sent and got back'''
+	def __init__(self,addr,id):
+		self.addr=addr
+		self.id=id
+		self.toret={}  #{port:(result,latency,attempts)}
+		self.sent={}  #{port:[send time of every round]}
+		self.buf=bytearray(19+PROBE.size)
+		self.s=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.s.setblocking(False)
+		self.s.setsockopt(socket.SOL_IP,IP_RECVERR,1)
+		self.s.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,RCVBUF)
+		self.poller=select.poll()
+		self.poller.register(self.s,select.POLLIN)  #Errors wake it up too
+
+	def send(self,port,r):
+		'''Sends port its probe for round r'''
+		data.packUnit(self.buf,CLIENT_WHO,self.id,PROBE.pack(port,r))
+		while True:
+			try:
+				self.s.sendto(self.buf,(self.addr,port))
+				break
+			except (BlockingIOError,InterruptedError):
+				self._waitSend()
+			except OSError as e:
+				if e.errno==errno.ENOBUFS:
+					self._waitSend()
+				elif e.errno not in UNREACHABLE:  #Those are in the error queue too, so just try again
+					raise
+		self.sent.setdefault(port,[]).append(time.monotonic())
+	def _waitSend(self):
+		'''Waits (a little) for room in the send buffer, reading replies meanwhile'''
+		self.poller.modify(self.s,select.POLLIN|select.POLLOUT)
+		self.poller.poll(100)
+		self.poller.modify(self.s,select.POLLIN)
+		self.read()
+
+	def read(self):
+		'''Takes every echo and ICMP error waiting on the socket'''
+		while True:
+			try:
+				msg,src=self.s.recvfrom(64)
+			except (BlockingIOError,InterruptedError):
+				break
+			except OSError as e:
+				if e.errno in UNREACHABLE:  #Details are in the error queue
+					continue
+				raise
+			port=src[1]
+			if src[0]!=self.addr or port not in self.sent or port in self.toret:
+				continue
+			self.toret[port]=self._echo(msg,port)
+		self._errors()
+	def _echo(self,msg,port):
+		'''Returns the result for a datagram that came back from port'''
+		tries=self.sent[port]
+		if len(msg)==len(self.buf):
+			who,key,n=data.unpackFrame(msg)
+			if who==SERVER_WHO and key==self.id and n==PROBE.size:
+				p,r=PROBE.unpack_from(msg,19)
+				if p==port and r<len(tries):
+					return (0,time.monotonic()-tries[r],len(tries))
+		return (3,time.monotonic()-tries[-1],len(tries))  #Something else is on this port
+	def _errors(self):
+		'''Takes every ICMP error in the error queue'''
+		while True:
+			try:
+				_,ancdata,_,dst=self.s.recvmsg(64,256,MSG_ERRQUEUE)
+			except (BlockingIOError,InterruptedError):
+				return
+			if not dst or dst[0]!=self.addr or dst[1] not in self.sent or dst[1] in self.toret:
+				continue
+			for level,kind,cdata in ancdata:
+				if level==socket.SOL_IP and kind==IP_RECVERR and len(cdata)>=EXTENDED_ERR.size:
+					err=EXTENDED_ERR.unpack_from(cdata)[0]
+					self.toret[dst[1]]=(1 if err==errno.ECONNREFUSED else 2,None,len(self.sent[dst[1]]))
+
+	def close(self):
+		self.poller.unregister(self.s)
+		self.s.close()
+
+if __name__=="__main__":
+	import sys
+	#Ex: python udp.py 127.0.0.1 1 1024
+	#Without a server echoing, open ports are DROPPED or SRVERR (if something answered)
+	addr=sys.argv[1] if len(sys.argv)>1 else "127.0.0.1"
+	start=int(sys.argv[2]) if len(sys.argv)>2 else 1
+	end=int(sys.argv[3]) if len(sys.argv)>3 else 1025
+	t=time.monotonic()
+	res=probePorts(addr,range(start,end),1)
+	t=time.monotonic()-t
+	counts=[0,0,0,0]
+	for r in res.values():
+		counts[r[0]]+=1
+	print(f"[|X:{MY_NAME}]: {len(res)} ports in {t:.2f}s ({len(res)/t:.0f} ports/s)")
+	for name,c in zip(("accept","close","drop","srverr"),counts):
+		print(f"  {name}: {c}")